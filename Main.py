@@ -1,41 +1,924 @@
 import os
 import sys
+import posixpath
+import struct
+import threading
 import zipfile
 import json
+import marshal
+import mmap
+import multiprocessing
+import zlib
 from datetime import datetime
+import fnmatch
 import getpass
+import hashlib
+import random
+import re
+import stat
 import argparse
+import asyncio
+import bz2
+import atexit
+import codecs
+import contextlib
+import copy
+import cProfile
+import io
+import math
+import pstats
+import time
+import tracemalloc
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from itertools import chain
+
+try:
+    from re import _parser as _sre_parse
+except ImportError:
+    # Python до 3.11
+    import sre_parse as _sre_parse
+
+# Элемент листинга директории: имя, признак директории, размер, время изменения,
+# сжатый размер и внешние атрибуты (в старших 16 битах - unix-режим)
+DirEntry = namedtuple('DirEntry', ['name', 'is_dir', 'size', 'mtime', 'compress_size', 'external_attr'])
+
+
+# Запись центрального каталога ZIP (46 байт заголовка без имени, extra и комментария)
+_CENTRAL_DIR = struct.Struct(zipfile.structCentralDir)
+# Локальный заголовок элемента (30 байт), за ним имя, extra и данные
+_LOCAL_HEADER = struct.Struct(zipfile.structFileHeader)
+_ZIP64_LIMIT = 0xFFFFFFFF
+
+
+def _dos_date_time(dos_time):
+    """Распаковка DOS-даты (старшие 16 бит) и времени в кортеж как у ZipInfo.date_time"""
+    d, t = dos_time >> 16, dos_time & 0xFFFF
+    return ((d >> 9) + 1980, (d >> 5) & 0xF, d & 0x1F,
+            t >> 11, (t >> 5) & 0x3F, (t & 0x1F) * 2)
+
+
+def _dos_time_key(date_time):
+    """Обратное преобразование: кортеж date_time в упакованное DOS-время (ключ сортировки)"""
+    year, month, day, hour, minute, second = date_time
+    return (max(year - 1980, 0) << 25 | month << 21 | day << 16
+            | hour << 11 | minute << 5 | second // 2)
+
+
+def _entry_mtime(date_time):
+    """datetime по кортежу date_time; None для недопустимой даты (нулевое DOS-время допустимо в ZIP)"""
+    try:
+        return datetime(*date_time)
+    except ValueError:
+        return None
+
+
+class ZipInfoTable(list):
+    """Таблица элементов архива поверх готового списка ZipInfo (обычный режим zipfile)"""
+
+    def __init__(self, infos=()):
+        super().__init__(infos)
+        # Столбцы ключей сортировки строятся при первом запросе
+        self.sort_columns = {}
+
+    def names(self):
+        return (info.filename for info in self)
+
+    def name(self, entry_id):
+        return self[entry_id].filename
+
+    def file_size(self, entry_id):
+        return self[entry_id].file_size
+
+    def date_time(self, entry_id):
+        return self[entry_id].date_time
+
+    def compress_type(self, entry_id):
+        return self[entry_id].compress_type
+
+    def compress_size(self, entry_id):
+        return self[entry_id].compress_size
+
+    def header_offset(self, entry_id):
+        return self[entry_id].header_offset
+
+    def flag_bits(self, entry_id):
+        return self[entry_id].flag_bits
+
+    def crc(self, entry_id):
+        return self[entry_id].CRC
+
+    def external_attr(self, entry_id):
+        return self[entry_id].external_attr
+
+    def sort_keys(self, field):
+        """Ключи сортировки по номеру элемента: 'size' - размер, 'mtime' - упакованное DOS-время"""
+        keys = self.sort_columns.get(field)
+        if keys is None:
+            if field == 'size':
+                keys = array('Q', (info.file_size for info in self))
+            else:
+                keys = array('L', (_dos_time_key(info.date_time) for info in self))
+            self.sort_columns[field] = keys
+        return keys
+
+
+class LeanCentralDirectory:
+    """Центральный каталог ZIP без создания ZipInfo на каждый элемент.
+
+    Горячие метаданные лежат в столбцах-массивах, имена и полные записи
+    остаются в исходных байтах каталога; ZipInfo собирается по запросу.
+    """
+
+    # Столбцы метаданных и типы их массивов
+    COLUMNS = (('record_offsets', 'Q'), ('header_offsets', 'Q'), ('compress_sizes', 'Q'),
+               ('file_sizes', 'Q'), ('crcs', 'L'), ('methods', 'H'), ('flags', 'H'),
+               ('dos_times', 'L'), ('external_attrs', 'L'))
+
+    def __init__(self, data, concat=0, state=None):
+        self.data = data
+        self.concat = concat
+        for column, typecode in self.COLUMNS:
+            setattr(self, column, array(typecode))
+        if state is None:
+            self._parse()
+        else:
+            # Столбцы уже разобраны ранее (кэш индекса) - только восстанавливаем массивы
+            for (column, _), raw in zip(self.COLUMNS, state):
+                getattr(self, column).frombytes(raw)
+
+    def get_state(self):
+        """Столбцы в виде байтов для сохранения в кэш"""
+        return tuple(getattr(self, column).tobytes() for column, _ in self.COLUMNS)
+
+    def _parse(self):
+        """Разбор всех записей каталога в столбцы"""
+        data = self.data
+        size = len(data)
+        unpack = _CENTRAL_DIR.unpack_from
+        signature = zipfile.stringCentralDir
+        concat = self.concat
+        columns = (self.record_offsets, self.header_offsets, self.compress_sizes,
+                   self.file_sizes, self.crcs, self.methods, self.flags,
+                   self.dos_times, self.external_attrs)
+        appends = [column.append for column in columns]
+        (add_record, add_header, add_csize, add_fsize, add_crc,
+         add_method, add_flags, add_time, add_attr) = appends
+
+        pos = 0
+        while pos < size:
+            try:
+                (sig, _, _, _, _, flags, method, t, d, crc, csize, fsize,
+                 name_len, extra_len, comment_len, _, _, attr, offset) = unpack(data, pos)
+            except struct.error:
+                raise zipfile.BadZipFile("Truncated central directory") from None
+            if sig != signature:
+                raise zipfile.BadZipFile("Bad magic number for central directory")
+            if _ZIP64_LIMIT in (csize, fsize, offset):
+                extra_start = pos + _CENTRAL_DIR.size + name_len
+                fsize, csize, offset = self._zip64_sizes(
+                    data[extra_start:extra_start + extra_len], fsize, csize, offset)
+
+            add_record(pos)
+            add_header(offset + concat)
+            add_csize(csize)
+            add_fsize(fsize)
+            add_crc(crc)
+            add_method(method)
+            add_flags(flags)
+            add_time(d << 16 | t)
+            add_attr(attr)
+            pos += _CENTRAL_DIR.size + name_len + extra_len + comment_len
+
+    @staticmethod
+    def _zip64_sizes(extra, file_size, compress_size, header_offset):
+        """Размеры и смещение из extra-поля ZIP64 (как ZipInfo._decodeExtra)"""
+        while len(extra) >= 4:
+            tp, ln = struct.unpack_from('<HH', extra)
+            if tp == 0x0001:
+                values = extra[4:ln + 4]
+                try:
+                    if file_size == _ZIP64_LIMIT:
+                        file_size, = struct.unpack_from('<Q', values)
+                        values = values[8:]
+                    if compress_size == _ZIP64_LIMIT:
+                        compress_size, = struct.unpack_from('<Q', values)
+                        values = values[8:]
+                    if header_offset == _ZIP64_LIMIT:
+                        header_offset, = struct.unpack_from('<Q', values)
+                except struct.error:
+                    raise zipfile.BadZipFile("Corrupt zip64 extra field") from None
+                break
+            extra = extra[ln + 4:]
+        return file_size, compress_size, header_offset
+
+    def __len__(self):
+        return len(self.record_offsets)
+
+    def _raw_name(self, entry_id):
+        pos = self.record_offsets[entry_id] + _CENTRAL_DIR.size
+        name_len, = struct.unpack_from('<H', self.data, pos - 18)
+        return self.data[pos:pos + name_len]
+
+    def name(self, entry_id):
+        """Имя элемента с учетом флага UTF-8, как в zipfile"""
+        encoding = 'utf-8' if self.flags[entry_id] & 0x800 else 'cp437'
+        return self._raw_name(entry_id).decode(encoding)
+
+    def names(self):
+        return (self.name(entry_id) for entry_id in range(len(self)))
+
+    def file_size(self, entry_id):
+        return self.file_sizes[entry_id]
+
+    def date_time(self, entry_id):
+        return _dos_date_time(self.dos_times[entry_id])
+
+    def compress_type(self, entry_id):
+        return self.methods[entry_id]
+
+    def compress_size(self, entry_id):
+        return self.compress_sizes[entry_id]
+
+    def header_offset(self, entry_id):
+        return self.header_offsets[entry_id]
+
+    def flag_bits(self, entry_id):
+        return self.flags[entry_id]
+
+    def crc(self, entry_id):
+        return self.crcs[entry_id]
+
+    def external_attr(self, entry_id):
+        return self.external_attrs[entry_id]
+
+    def sort_keys(self, field):
+        """Ключи сортировки по номеру элемента - готовые столбцы размера и DOS-времени"""
+        return self.file_sizes if field == 'size' else self.dos_times
+
+    def __getitem__(self, entry_id):
+        """Полный ZipInfo элемента, собранный из исходной записи каталога"""
+        pos = self.record_offsets[entry_id]
+        centdir = _CENTRAL_DIR.unpack_from(self.data, pos)
+        name_len, extra_len, comment_len = centdir[12:15]
+        pos += _CENTRAL_DIR.size
+
+        info = zipfile.ZipInfo(self.name(entry_id), self.date_time(entry_id))
+        info.extra = self.data[pos + name_len:pos + name_len + extra_len]
+        pos += name_len + extra_len
+        info.comment = self.data[pos:pos + comment_len]
+        (info.create_version, info.create_system, info.extract_version, info.reserved,
+         info.flag_bits, info.compress_type, info._raw_time) = centdir[1:8]
+        info.volume, info.internal_attr, info.external_attr = centdir[15:18]
+        info.CRC = self.crcs[entry_id]
+        info.compress_size = self.compress_sizes[entry_id]
+        info.file_size = self.file_sizes[entry_id]
+        info.header_offset = self.header_offsets[entry_id]
+        return info
+
+
+class LeanZipFile(zipfile.ZipFile):
+    """ZipFile, который читает центральный каталог в LeanCentralDirectory.
+
+    Списки filelist/NameToInfo остаются пустыми: элементы открываются
+    через open(ZipInfo), где ZipInfo берется из self.entries по номеру.
+    """
+
+    def __init__(self, file, mode='r', entries_state=None, **kwargs):
+        self._entries_state = entries_state
+        super().__init__(file, mode, **kwargs)
+
+    def _RealGetContents(self):
+        fp = self.fp
+        try:
+            endrec = zipfile._EndRecData(fp)
+        except OSError:
+            raise zipfile.BadZipFile("File is not a zip file")
+        if not endrec:
+            raise zipfile.BadZipFile("File is not a zip file")
+
+        size_cd = endrec[zipfile._ECD_SIZE]
+        offset_cd = endrec[zipfile._ECD_OFFSET]
+        self._comment = endrec[zipfile._ECD_COMMENT]
+
+        # concat отличен от нуля, только если архив дописан к другому файлу
+        concat = endrec[zipfile._ECD_LOCATION] - size_cd - offset_cd
+        if endrec[zipfile._ECD_SIGNATURE] == zipfile.stringEndArchive64:
+            concat -= zipfile.sizeEndCentDir64 + zipfile.sizeEndCentDir64Locator
+
+        self.start_dir = offset_cd + concat
+        if self.start_dir < 0:
+            raise zipfile.BadZipFile("Bad offset for central directory")
+        fp.seek(self.start_dir, 0)
+        self.entries = LeanCentralDirectory(fp.read(size_cd), concat, self._entries_state)
+
+
+class DirectoryIndex:
+    """Индекс дерева директорий VFS: директория -> потомки, путь -> номер элемента архива"""
+
+    def __init__(self, entries=None):
+        # Ключи - пути без ведущего и завершающего слеша, '' - корень
+        self.dirs = {'': {}}
+        self.files = {}
+        # Итоги поддерева директории: [файлов, байт, сжатых байт]
+        self.totals = {}
+        if entries is not None:
+            for entry_id, name in enumerate(entries.names()):
+                self.add(name, entry_id)
+            self._sum_totals(entries)
+
+    def add(self, filename, entry_id):
+        """Добавление элемента архива в индекс"""
+        name = filename.replace('\\', '/').strip('/')
+        if not name:
+            return
+        if filename.endswith('/'):
+            self._ensure_dir(name)
+            return
+
+        parent, _, base = name.rpartition('/')
+        self._ensure_dir(parent)[base] = False
+        self.files[name] = entry_id
+
+    def _ensure_dir(self, path):
+        """Создание директории и всех ее предков (для архивов без явных записей директорий)"""
+        children = self.dirs.get(path)
+        if children is None:
+            children = self.dirs[path] = {}
+            parent, _, base = path.rpartition('/')
+            self._ensure_dir(parent)[base] = True
+        return children
+
+    def _sum_totals(self, entries):
+        """Подсчет итогов поддеревьев: файлы в свои директории, затем директории снизу вверх"""
+        totals = {path: [0, 0, 0] for path in self.dirs}
+        for path, entry_id in self.files.items():
+            total = totals[path.rpartition('/')[0]]
+            total[0] += 1
+            total[1] += entries.file_size(entry_id)
+            total[2] += entries.compress_size(entry_id)
+        for path in sorted(self.dirs, key=lambda path: path.count('/'), reverse=True):
+            if path:
+                total, parent = totals[path], totals[path.rpartition('/')[0]]
+                parent[0] += total[0]
+                parent[1] += total[1]
+                parent[2] += total[2]
+        self.totals = totals
+
+    def is_dir(self, path):
+        """Проверка существования директории"""
+        return path in self.dirs
+
+    def subdirs(self, path):
+        """Отсортированные имена поддиректорий"""
+        return sorted(name for name, is_dir in self.dirs[path].items() if is_dir)
+
+    def subtree_totals(self, path):
+        """Итоги поддерева директории (файлов, байт, сжатых байт); None - нет такой директории"""
+        total = self.totals.get(path)
+        return tuple(total) if total is not None else None
+
+    def get_file(self, path):
+        """Номер элемента архива для файла по пути или None"""
+        return self.files.get(path)
+
+    def iter_children(self, path):
+        """Потомки директории в виде (имя, директория?, номер элемента или None); None - нет такой директории"""
+        children = self.dirs.get(path)
+        if children is None:
+            return None
+        prefix = path + '/' if path else ''
+        files = self.files
+        return ((name, is_dir, None if is_dir else files[prefix + name])
+                for name, is_dir in children.items())
+
+    def counts(self):
+        """Количество файлов и директорий (без корня)"""
+        return len(self.files), len(self.dirs) - 1
+
+    def get_state(self):
+        """Состояние индекса для сохранения в кэш"""
+        return self.dirs, self.files, self.totals
+
+    @classmethod
+    def from_state(cls, state):
+        """Восстановление индекса из кэша"""
+        index = cls()
+        index.dirs, index.files, index.totals = state
+        return index
+
+
+class _TrieNode:
+    """Узел компактного индекса - одна директория"""
+    __slots__ = ('dir_names', 'dirs', 'file_names', 'file_ids', 'totals', 'lookup')
+
+    def __init__(self):
+        self.dir_names = []
+        self.dirs = []
+        self.file_names = []
+        self.file_ids = array('I')
+        # Итоги поддерева: (файлов, байт, сжатых байт)
+        self.totals = (0, 0, 0)
+        # Словари имя -> позиция (директории, файлы) нужны только на время построения
+        self.lookup = ({}, {})
+
+
+class CompactIndex:
+    """Компактный индекс для архивов с миллионами элементов.
+
+    Вместо полных путей хранятся интернированные компоненты имен, потомки
+    директории лежат в отсортированных кортежах, а файлы ссылаются на
+    элемент архива номером в массиве. Поиск - бинарный по каждому уровню пути.
+    """
+
+    # Целевой расход памяти индекса на один элемент архива для широких неглубоких
+    # деревьев с короткими именами (до ~16 символов, как в профиле 'wide');
+    # глубокие деревья с длинными путями (форма deep бенчмарка) дают около 223 Б
+    # на элемент. Цель относится только к индексу: компактный индекс включает экономное
+    # чтение, и его таблица элементов добавляет еще ~170 Б (всего ~250 Б на элемент
+    # против ~780 Б с обычным индексом и ZipInfo). Проверяется тестом tests/test_compact_index.py
+    TARGET_BYTES_PER_ENTRY = 100
+
+    def __init__(self, entries):
+        self.root = _TrieNode()
+        self.file_count = 0
+        self.dir_count = 0
+        for entry_id, name in enumerate(entries.names()):
+            self.add(name, entry_id)
+        self._finalize(self.root)
+        self._sum_totals(entries)
+
+    def add(self, filename, entry_id):
+        """Добавление элемента архива в индекс"""
+        name = filename.replace('\\', '/').strip('/')
+        if not name:
+            return
+        parts = name.split('/')
+        if filename.endswith('/'):
+            self._ensure_dir(parts)
+            return
+
+        node = self._ensure_dir(parts[:-1])
+        base = sys.intern(parts[-1])
+        file_lookup = node.lookup[1]
+        pos = file_lookup.get(base)
+        if pos is not None:
+            # Повторная запись с тем же именем - побеждает последняя, как в zipfile
+            node.file_ids[pos] = entry_id
+            return
+        file_lookup[base] = len(node.file_names)
+        node.file_names.append(base)
+        node.file_ids.append(entry_id)
+        self.file_count += 1
+
+    def _ensure_dir(self, parts):
+        """Спуск по пути с созданием недостающих директорий"""
+        node = self.root
+        for part in parts:
+            dir_lookup = node.lookup[0]
+            pos = dir_lookup.get(part)
+            if pos is None:
+                child = _TrieNode()
+                part = sys.intern(part)
+                dir_lookup[part] = len(node.dirs)
+                node.dir_names.append(part)
+                node.dirs.append(child)
+                self.dir_count += 1
+                node = child
+            else:
+                node = node.dirs[pos]
+        return node
+
+    def _finalize(self, root):
+        """Сортировка потомков и сжатие списков в кортежи после построения"""
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            node.lookup = None
+            if node.dirs:
+                order = sorted(range(len(node.dir_names)), key=node.dir_names.__getitem__)
+                node.dir_names = tuple(node.dir_names[i] for i in order)
+                node.dirs = tuple(node.dirs[i] for i in order)
+                stack.extend(node.dirs)
+            else:
+                node.dir_names = node.dirs = ()
+            if node.file_names:
+                order = sorted(range(len(node.file_names)), key=node.file_names.__getitem__)
+                node.file_names = tuple(node.file_names[i] for i in order)
+                node.file_ids = array('I', (node.file_ids[i] for i in order))
+            else:
+                node.file_names = ()
+                node.file_ids = array('I')
+
+    def _sum_totals(self, entries):
+        """Подсчет итогов поддеревьев обходом в обратном порядке (потомки раньше родителя)"""
+        order = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(node.dirs)
+        for node in reversed(order):
+            files = len(node.file_ids)
+            size = sum(map(entries.file_size, node.file_ids))
+            compressed = sum(map(entries.compress_size, node.file_ids))
+            for child in node.dirs:
+                files += child.totals[0]
+                size += child.totals[1]
+                compressed += child.totals[2]
+            node.totals = (files, size, compressed)
+
+    @staticmethod
+    def _find(names, name):
+        """Бинарный поиск имени в отсортированном кортеже, -1 если нет"""
+        pos = bisect_left(names, name)
+        if pos < len(names) and names[pos] == name:
+            return pos
+        return -1
+
+    def _find_dir(self, path):
+        node = self.root
+        if not path:
+            return node
+        for part in path.split('/'):
+            pos = self._find(node.dir_names, part)
+            if pos < 0:
+                return None
+            node = node.dirs[pos]
+        return node
+
+    def is_dir(self, path):
+        """Проверка существования директории"""
+        return self._find_dir(path) is not None
+
+    def get_file(self, path):
+        """Номер элемента архива для файла по пути или None"""
+        parent, _, base = path.rpartition('/')
+        node = self._find_dir(parent)
+        if node is None:
+            return None
+        pos = self._find(node.file_names, base)
+        if pos < 0:
+            return None
+        return node.file_ids[pos]
+
+    def subdirs(self, path):
+        """Отсортированные имена поддиректорий"""
+        return self._find_dir(path).dir_names
+
+    def subtree_totals(self, path):
+        """Итоги поддерева директории (файлов, байт, сжатых байт); None - нет такой директории"""
+        node = self._find_dir(path)
+        return node.totals if node is not None else None
+
+    def iter_children(self, path):
+        """Потомки директории в виде (имя, директория?, номер элемента или None); None - нет такой директории"""
+        node = self._find_dir(path)
+        if node is None:
+            return None
+        dirs = ((name, True, None) for name in node.dir_names)
+        files = ((name, False, entry_id)
+                 for name, entry_id in zip(node.file_names, node.file_ids))
+        return chain(dirs, files)
+
+    def counts(self):
+        """Количество файлов и директорий (без корня)"""
+        return self.file_count, self.dir_count
+
+    def get_state(self):
+        """Узлы в прямом порядке обхода для сохранения в кэш"""
+        nodes = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            nodes.append((node.dir_names, node.file_names, node.file_ids.tobytes(), node.totals))
+            stack.extend(reversed(node.dirs))
+        return self.file_count, self.dir_count, nodes
+
+    @classmethod
+    def from_state(cls, state):
+        """Восстановление дерева из кэша без повторного разбора имен"""
+        index = cls.__new__(cls)
+        index.file_count, index.dir_count, nodes = state
+        nodes = iter(nodes)
+
+        def make_node():
+            node = _TrieNode()
+            node.lookup = None
+            node.dir_names, node.file_names, file_ids, node.totals = next(nodes)
+            node.dirs = [None] * len(node.dir_names)
+            node.file_ids.frombytes(file_ids)
+            return node
+
+        index.root = make_node()
+        # Стек из (узел, номер следующего потомка): потомки идут сразу за родителем
+        stack = [[index.root, 0]]
+        while stack:
+            top = stack[-1]
+            node, position = top
+            if position == len(node.dirs):
+                node.dirs = tuple(node.dirs)
+                stack.pop()
+                continue
+            top[1] += 1
+            child = make_node()
+            node.dirs[position] = child
+            stack.append([child, 0])
+        return index
+
+    def memory_footprint(self):
+        """Собственный расход памяти индекса в байтах (метаданные элементов архива не учитываются)"""
+        total = sys.getsizeof(self)
+        seen_names = set()
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            total += sys.getsizeof(node)
+            total += sys.getsizeof(node.dir_names) + sys.getsizeof(node.dirs)
+            total += sys.getsizeof(node.file_names) + sys.getsizeof(node.file_ids)
+            total += sys.getsizeof(node.totals)
+            # Интернированные имена считаются один раз
+            for name in chain(node.dir_names, node.file_names):
+                if id(name) not in seen_names:
+                    seen_names.add(id(name))
+                    total += sys.getsizeof(name)
+            stack.extend(node.dirs)
+        return total
+
+    def bytes_per_entry(self):
+        """Средний расход памяти на элемент архива"""
+        entries = self.file_count + self.dir_count
+        return self.memory_footprint() / entries if entries else 0.0
+
+
+class ContentCache:
+    """LRU-кэш распакованного содержимого элементов с ограничением по объему в байтах"""
+
+    def __init__(self, max_bytes, max_item_bytes=None):
+        self.max_bytes = max_bytes
+        # Один большой файл не должен вытеснять весь кэш
+        self.max_item_bytes = max_bytes // 4 if max_item_bytes is None else max_item_bytes
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Кэш общий для сессий сервера, команды которых идут в разных потоках
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        with self.lock:
+            if len(data) > self.max_item_bytes or key in self.items:
+                return
+            self.items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.items.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        """Счетчики кэша"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.items),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class LatencyHistogram:
+    """Гистограмма задержек с логарифмическими корзинами (4 на каждое удвоение).
+
+    Память не зависит от числа замеров, погрешность перцентилей - до ~19%.
+    """
+
+    BUCKETS_PER_OCTAVE = 4
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        micros = max(seconds * 1e6, 1.0)
+        bucket = int(math.log2(micros) * self.BUCKETS_PER_OCTAVE)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """Верхняя граница корзины, в которую попадает перцентиль (в секундах)"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                upper = 2 ** ((bucket + 1) / self.BUCKETS_PER_OCTAVE) / 1e6
+                return min(upper, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total * 1000,
+            'p50_ms': self.percentile(0.50) * 1000,
+            'p95_ms': self.percentile(0.95) * 1000,
+            'p99_ms': self.percentile(0.99) * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+
+class _TextIndexSlot:
+    """Полнотекстовый индекс архива, общий для всех представлений VFS (сессий сервера)"""
+
+    __slots__ = ('index', 'checked')
+
+    def __init__(self):
+        self.index = None
+        # Файл <vfs>.fts уже искали на диске
+        self.checked = False
+
 
 class VirtualFileSystem:
-    def __init__(self, vfs_path=None):
+    # Версия формата файла кэша индекса (меняется при изменении структуры)
+    INDEX_CACHE_VERSION = 2
+    # Алгоритм хеша содержимого архива для vfs-info
+    HASH_ALGORITHM = 'blake2b-256'
+
+    def __init__(self, vfs_path=None, compact_index=False, lean=False, index_cache=False,
+                 cache_bytes=64 << 20):
+        # Вывод сообщений; оболочка подменяет его своим буферизованным выводом
+        self.echo = print
         self.vfs_path = vfs_path
         self.archive = None
+        self.entries = None
+        self.index = None
+        # Отображение архива в память, смещения данных несжатых элементов, элементы
+        # с уже проверенным CRC и число переводов строк в них (считается для tail)
+        self.mapping = None
+        self.data_offsets = {}
+        self.crc_verified = set()
+        self.stored_lines = {}
+        # Кэш распакованного содержимого (0 - отключен)
+        self.content_cache = ContentCache(cache_bytes) if cache_bytes else None
+        # Сколько байт распаковано через zipfile (для статистики)
+        self.bytes_decompressed = 0
+        # Хеш содержимого: ((путь, размер, mtime), hex), фоновый поток и его прогресс
+        self.content_hash = None
+        self.hash_thread = None
+        self.hash_progress = (0, 0)
+        self.hash_error = None
+        # Пул процессов grep создается при первом поиске
+        self.searcher = None
+        # Полнотекстовый индекс (index-build); файл <vfs>.fts читается при первом поиске
+        self.text_slot = _TextIndexSlot()
+        self.compact_index = compact_index
+        # Кэш индекса хранит разобранный каталог, поэтому работает только с экономным чтением;
+        # компактному индексу без него мало толку - память занимают ZipInfo каждого файла
+        self.lean = lean or index_cache or compact_index
+        self.index_cache = index_cache
         self.current_dir = '/'
         self.vfs_name = os.path.basename(vfs_path) if vfs_path else "default"
 
         if vfs_path and os.path.exists(vfs_path):
             self.load_vfs(vfs_path)
         elif vfs_path:
-            print(f"Файл VFS '{vfs_path}' не найден")
+            self.echo(f"Файл VFS '{vfs_path}' не найден")
 
     def load_vfs(self, vfs_path):
         """Загрузка VFS из ZIP-архива"""
         try:
-            self.archive = zipfile.ZipFile(vfs_path, 'r')
+            index_class = CompactIndex if self.compact_index else DirectoryIndex
+            cached = self._load_index_cache(vfs_path, index_class) if self.index_cache else None
+
+            # В экономном режиме ZipInfo не создаются при открытии архива
+            if self.lean:
+                self.archive = LeanZipFile(vfs_path, 'r', cached and cached[0])
+                self.entries = self.archive.entries
+            else:
+                self.archive = zipfile.ZipFile(vfs_path, 'r')
+                self.entries = ZipInfoTable(self.archive.infolist())
             self.vfs_path = vfs_path
             self.vfs_name = os.path.basename(vfs_path)
-            print(f"VFS '{self.vfs_name}' успешно загружена")
+            self.current_dir = '/'
+            self.data_offsets = {}
+            self.crc_verified = set()
+            self.stored_lines = {}
+            self.text_slot = _TextIndexSlot()
+            with open(vfs_path, 'rb') as f:
+                self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            # Индекс строится один раз, все дальнейшие поиски идут через него
+            if cached:
+                self.index = index_class.from_state(cached[1])
+            else:
+                self.index = index_class(self.entries)
+                if self.index_cache:
+                    self._save_index_cache(vfs_path, index_class)
+
+            self.echo(f"VFS '{self.vfs_name}' успешно загружена")
             
             # Проверяем, что архив не пустой
-            if len(self.archive.namelist()) == 0:
-                print("Внимание: архив пуст")
+            if self.index.counts() == (0, 0):
+                self.echo("Внимание: архив пуст")
                 
         except zipfile.BadZipFile:
-            print(f"Ошибка: файл '{vfs_path}' не является корректным ZIP-архивом")
+            self.echo(f"Ошибка: файл '{vfs_path}' не является корректным ZIP-архивом")
             self.archive = None
+            self.entries = None
+            self.index = None
         except Exception as e:
-            print(f"Ошибка загрузки VFS: {e}")
+            self.echo(f"Ошибка загрузки VFS: {e}")
             self.archive = None
+            self.entries = None
+            self.index = None
+
+    @staticmethod
+    def _index_cache_key(vfs_path):
+        """Ключ кэша: путь, размер, время изменения и CRC начала и конца архива (там лежит EOCD)"""
+        stats = os.stat(vfs_path)
+        with open(vfs_path, 'rb') as f:
+            checksum = zlib.crc32(f.read(65536))
+            f.seek(max(0, stats.st_size - 65536))
+            checksum = zlib.crc32(f.read(65536), checksum)
+        return os.path.abspath(vfs_path), stats.st_size, stats.st_mtime_ns, checksum
+
+    def _load_index_cache(self, vfs_path, index_class):
+        """Чтение кэша индекса; None, если кэша нет или архив изменился"""
+        cache_path = vfs_path + '.idx'
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            with open(cache_path, 'rb') as f:
+                version, key, kind, entries_state, index_state = marshal.load(f)
+        except Exception:
+            return None
+        if (version != self.INDEX_CACHE_VERSION or kind != index_class.__name__
+                or key != self._index_cache_key(vfs_path)):
+            return None
+        return entries_state, index_state
+
+    def _save_index_cache(self, vfs_path, index_class):
+        """Сохранение построенного индекса рядом с архивом"""
+        cache_path = vfs_path + '.idx'
+        try:
+            payload = (self.INDEX_CACHE_VERSION, self._index_cache_key(vfs_path), index_class.__name__,
+                       self.entries.get_state(), self.index.get_state())
+            # Запись через временный файл, чтобы не оставить обрезанный кэш
+            with open(cache_path + '.tmp', 'wb') as f:
+                marshal.dump(payload, f)
+            os.replace(cache_path + '.tmp', cache_path)
+        except Exception as e:
+            self.echo(f"Не удалось сохранить кэш индекса: {e}")
+
+    def session_view(self):
+        """Представление VFS для сессии сервера: своя текущая директория, общие индексы, архив и кэши"""
+        view = copy.copy(self)
+        view.current_dir = '/'
+        return view
+
+    def get_text_index(self):
+        """Полнотекстовый индекс: построенный в сессии или из файла <vfs>.fts; None, если его нет"""
+        slot = self.text_slot
+        if slot.index is None and not slot.checked and self.archive:
+            slot.checked = True
+            path = self.vfs_path + TrigramIndex.SUFFIX
+            if os.path.exists(path):
+                slot.index = TrigramIndex.load(path, self._index_cache_key(self.vfs_path))
+        return slot.index
+
+    def build_text_index(self):
+        """Построение полнотекстового индекса и сохранение его рядом с архивом"""
+        index = TrigramIndex.build(self)
+        # Индекс сразу виден всем сессиям, разделяющим архив
+        self.text_slot.index = index
+        try:
+            index.save(self.vfs_path + TrigramIndex.SUFFIX, self._index_cache_key(self.vfs_path))
+        except OSError as e:
+            self.echo(f"Не удалось сохранить полнотекстовый индекс: {e}")
+        return index
 
     def create_test_vfs(self, vfs_path):
         """Создание тестовой VFS для демонстрации"""
@@ -49,11 +932,11 @@ class VirtualFileSystem:
                 zf.writestr('data/config.json', '{"app": "test", "version": 1.0, "author": "user"}')
                 zf.writestr('images/readme.txt', 'Здесь могли бы быть ваши изображения')
             
-            print(f"Создана тестовая VFS: {vfs_path}")
+            self.echo(f"Создана тестовая VFS: {vfs_path}")
             self.load_vfs(vfs_path)
             return True
         except Exception as e:
-            print(f"Ошибка создания тестовой VFS: {e}")
+            self.echo(f"Ошибка создания тестовой VFS: {e}")
             return False
 
     def get_vfs_info(self):
@@ -63,86 +946,195 @@ class VirtualFileSystem:
 
         try:
             file_stats = os.stat(self.vfs_path)
-            # Простая хеш-функция для демонстрации
-            vfs_hash = hex(hash(f"{self.vfs_name}{file_stats.st_size}{file_stats.st_mtime}"))[-8:]
             
-            # Подсчет файлов и директорий
-            all_files = self.archive.namelist()
-            file_count = len([f for f in all_files if not f.endswith('/')])
-            dir_count = len([d for d in all_files if d.endswith('/')])
+            # Подсчет файлов и директорий по индексу (корень не считается)
+            file_count, dir_count = self.index.counts()
             
             return {
                 'name': self.vfs_name,
                 'path': os.path.abspath(self.vfs_path),
-                'hash': vfs_hash.upper(),
+                'hash': self.hash_status(file_stats),
                 'files_count': file_count,
                 'dirs_count': dir_count,
-                'total_entries': len(all_files),
+                'total_entries': file_count + dir_count,
                 'size': file_stats.st_size,
                 'modified': datetime.fromtimestamp(file_stats.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
             }
         except Exception as e:
             return f"Ошибка получения информации: {e}"
 
+    def _hash_key(self, file_stats):
+        return [os.path.abspath(self.vfs_path), file_stats.st_size, file_stats.st_mtime_ns]
+
+    def cached_hash(self, file_stats=None):
+        """Готовый хеш содержимого архива (из памяти или файла <vfs>.hash) или None"""
+        file_stats = file_stats or os.stat(self.vfs_path)
+        key = self._hash_key(file_stats)
+        if self.content_hash is not None and self.content_hash[0] == key:
+            return self.content_hash[1]
+
+        try:
+            with open(self.vfs_path + '.hash', 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get('key') != key or cached.get('algorithm') != self.HASH_ALGORITHM:
+            return None
+        self.content_hash = (key, cached['hash'])
+        return cached['hash']
+
+    def compute_hash(self, chunk_size=1 << 20):
+        """Потоковый BLAKE2b-256 всего файла архива; результат сохраняется в <vfs>.hash"""
+        file_stats = os.stat(self.vfs_path)
+        key = self._hash_key(file_stats)
+        digest = hashlib.blake2b(digest_size=32)
+        done = 0
+        self.hash_progress = (0, file_stats.st_size)
+        with open(self.vfs_path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                done += len(chunk)
+                self.hash_progress = (done, file_stats.st_size)
+
+        result = digest.hexdigest()
+        self.content_hash = (key, result)
+        try:
+            with open(self.vfs_path + '.hash', 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'algorithm': self.HASH_ALGORITHM, 'hash': result}, f)
+        except OSError:
+            # Каталог архива может быть недоступен для записи - хеш останется в памяти
+            pass
+        return result
+
+    def start_hash(self):
+        """Запуск вычисления хеша в фоновом потоке; False, если хеш уже есть или считается"""
+        if not self.archive or self.cached_hash():
+            return False
+        if self.hash_thread is not None and self.hash_thread.is_alive():
+            return False
+
+        def worker():
+            try:
+                self.compute_hash()
+            except Exception as e:
+                self.hash_error = str(e)
+
+        self.hash_error = None
+        self.hash_progress = (0, os.path.getsize(self.vfs_path))
+        self.hash_thread = threading.Thread(target=worker, name='vfs-hash', daemon=True)
+        self.hash_thread.start()
+        return True
+
+    def hash_status(self, file_stats=None):
+        """Хеш для vfs-info: готовое значение или состояние фонового вычисления"""
+        result = self.cached_hash(file_stats)
+        if result:
+            return f"{self.HASH_ALGORITHM}:{result}"
+        if self.hash_thread is not None and self.hash_thread.is_alive():
+            done, total = self.hash_progress
+            return f"вычисляется: {done * 100 // max(total, 1)}% ({done}/{total} байт)"
+        if self.hash_error:
+            return f"ошибка вычисления: {self.hash_error}"
+        return "не вычислен (vfs-info --hash)"
+
+    def resolve_path(self, path=None):
+        """Нормализованный путь внутри архива (без ведущего слеша) с учетом текущей директории"""
+        if not path:
+            path = self.current_dir
+        elif not path.startswith('/'):
+            path = self.current_dir.rstrip('/') + '/' + path
+        return posixpath.normpath(path.replace('\\', '/')).strip('/')
+
+    def is_directory(self, path):
+        """Проверка, что путь указывает на директорию"""
+        if not self.archive:
+            return False
+        return self.index.is_dir(self.resolve_path(path))
+
     def list_files(self, directory=None):
         """Список файлов в указанной директории"""
         if not self.archive:
             return None
 
-        target_dir = directory if directory else self.current_dir
-        target_dir = target_dir.rstrip('/') + '/'
-        
-        # Если запрашивается корневая директория
-        if target_dir == '//':
-            target_dir = '/'
-
-        file_list = []
-        dir_set = set()
-        
-        for name in self.archive.namelist():
-            if name.startswith(target_dir) and name != target_dir:
-                # Получаем относительный путь
-                relative_path = name[len(target_dir):]
-                
-                # Если это файл в текущей директории
-                if '/' not in relative_path:
-                    file_list.append(relative_path)
-                else:
-                    # Это поддиректория - берем первую часть пути
-                    first_dir = relative_path.split('/')[0]
-                    dir_set.add(first_dir)
-        
-        # Объединяем файлы и директории
-        result = list(dir_set) + file_list
-        return sorted(result)
+        children = self.index.iter_children(self.resolve_path(directory))
+        if children is None:
+            return []
+        return sorted(name for name, _, _ in children)
+
+    def walk(self, directory=None):
+        """Обход поддерева по индексу в глубину: (путь без ведущего слеша, директория?, номер элемента).
+
+        Генератор хранит только стек итераторов по глубине дерева.
+        """
+        if not self.archive:
+            return
+        base = self.resolve_path(directory)
+        children = self.index.iter_children(base)
+        if children is None:
+            return
+
+        stack = [(base, children)]
+        while stack:
+            prefix, children = stack[-1]
+            for name, is_dir, entry_id in children:
+                path = f"{prefix}/{name}" if prefix else name
+                yield path, is_dir, entry_id
+                if is_dir:
+                    stack.append((path, self.index.iter_children(path)))
+                    break
+            else:
+                stack.pop()
+
+    def list_entries(self, directory=None, sort_by='name', reverse=False, show_hidden=True):
+        """Типизированный листинг директории с сортировкой по имени, размеру ('size') или времени ('mtime').
+
+        Порядок определяется по номерам элементов и готовым столбцам ключей,
+        DirEntry создаются уже для упорядоченного списка.
+        """
+        if not self.archive:
+            return None
+
+        children = self.index.iter_children(self.resolve_path(directory))
+        if children is None:
+            return []
+        if show_hidden:
+            children = list(children)
+        else:
+            children = [child for child in children if not child[0].startswith('.')]
+        children.sort(key=lambda child: child[0])
+        if sort_by != 'name':
+            keys = self.entries.sort_keys(sort_by)
+            # Большие и новые - первыми, как в ls; у директорий нет размера и времени - они в конце
+            children.sort(key=lambda child: -1 if child[1] else keys[child[2]], reverse=True)
+        if reverse:
+            children.reverse()
+
+        table = self.entries
+        entries = []
+        for name, is_dir, entry_id in children:
+            if is_dir:
+                entries.append(DirEntry(name, True, 0, None, 0, 0))
+            else:
+                entries.append(DirEntry(name, False, table.file_size(entry_id),
+                                        _entry_mtime(table.date_time(entry_id)),
+                                        table.compress_size(entry_id), table.external_attr(entry_id)))
+        return entries
 
     def change_directory(self, new_dir):
         """Смена текущей директории"""
         if not self.archive:
-            print("VFS не загружена")
+            self.echo("VFS не загружена")
             return False
 
-        if new_dir == '/':
-            self.current_dir = '/'
-            return True
-        elif new_dir == '..':
-            if self.current_dir != '/':
-                self.current_dir = os.path.dirname(self.current_dir.rstrip('/')) or '/'
+        target = self.resolve_path(new_dir)
+        if self.index.is_dir(target):
+            self.current_dir = '/' + target
             return True
-        elif new_dir.startswith('/'):
-            # Абсолютный путь
-            test_dir = new_dir.rstrip('/') + '/'
-        else:
-            # Относительный путь
-            test_dir = os.path.join(self.current_dir.rstrip('/'), new_dir).replace('\\', '/') + '/'
-
-        # Проверяем существование директории
-        for name in self.archive.namelist():
-            if name.startswith(test_dir) or name == test_dir.rstrip('/'):
-                self.current_dir = test_dir.rstrip('/') or '/'
-                return True
 
-        print(f"Директория '{new_dir}' не найдена")
+        self.echo(f"Директория '{new_dir}' не найдена")
         return False
 
     def read_file(self, filename):
@@ -150,45 +1142,846 @@ class VirtualFileSystem:
         if not self.archive:
             return None
 
-        # Обработка абсолютных и относительных путей
-        if filename.startswith('/'):
-            full_path = filename.lstrip('/')
-        else:
-            full_path = os.path.join(self.current_dir.lstrip('/'), filename).replace('\\', '/')
+        entry_id = self.index.get_file(self.resolve_path(filename))
+        if entry_id is None:
+            return None
 
-        # Убираем лишние слеши
-        full_path = full_path.replace('//', '/')
+        try:
+            return str(self.read_entry(entry_id), 'utf-8')
+        except UnicodeDecodeError:
+            self.echo(f"Файл '{filename}' содержит бинарные данные и не может быть прочитан как текст")
+            return None
+        except Exception as e:
+            self.echo(f"Ошибка чтения файла: {e}")
+            return None
 
-        if full_path in self.archive.namelist():
-            try:
-                with self.archive.open(full_path) as f:
-                    return f.read().decode('utf-8')
-            except UnicodeDecodeError:
-                print(f"Файл '{filename}' содержит бинарные данные и не может быть прочитан как текст")
-                return None
-            except Exception as e:
-                print(f"Ошибка чтения файла: {e}")
-                return None
-        else:
+    def read_bytes(self, filename):
+        """Содержимое файла в байтах (для несжатых элементов - memoryview без копирования)"""
+        if not self.archive:
+            return None
+
+        entry_id = self.index.get_file(self.resolve_path(filename))
+        if entry_id is None:
+            return None
+        return self.read_entry(entry_id)
+
+    def read_entry(self, entry_id):
+        """Содержимое элемента архива по номеру"""
+        view = self.mapped_view(entry_id)
+        if view is not None:
+            # Содержимое отдается целиком, поэтому CRC проверяется сразу
+            if entry_id not in self.crc_verified:
+                self._check_crc(entry_id, zlib.crc32(view))
+            return view
+
+        data = self.cached_content(entry_id)
+        if data is not None:
+            return data
+
+        with self.archive.open(self.entries[entry_id]) as f:
+            data = f.read()
+        self.bytes_decompressed += len(data)
+        return data
+
+    def cached_content(self, entry_id):
+        """Распакованное содержимое через кэш; None, если элемент в кэш не помещается"""
+        cache = self.content_cache
+        table = self.entries
+        if cache is None or table.file_size(entry_id) > cache.max_item_bytes:
+            return None
+
+        # CRC в ключе отличает разные версии элемента с одинаковым именем
+        key = (table.name(entry_id), table.crc(entry_id))
+        data = cache.get(key)
+        if data is None:
+            with self.archive.open(table[entry_id]) as f:
+                data = f.read()
+            self.bytes_decompressed += len(data)
+            cache.put(key, data)
+        return data
+
+    def mapped_view(self, entry_id):
+        """Срез отображения архива для несжатого незашифрованного элемента, иначе None (CRC не проверяется)"""
+        table = self.entries
+        if (self.mapping is None or table.compress_type(entry_id) != zipfile.ZIP_STORED
+                or table.flag_bits(entry_id) & 0x1):
+            return None
+        start = self.data_offset(entry_id)
+        return memoryview(self.mapping)[start:start + table.file_size(entry_id)]
+
+    def _check_crc(self, entry_id, crc):
+        """Сверка CRC прочитанного элемента с каталогом; проверенные элементы запоминаются"""
+        if crc != self.entries.crc(entry_id):
+            raise zipfile.BadZipFile(f"Bad CRC-32 for file {self.entries.name(entry_id)!r}")
+        self.crc_verified.add(entry_id)
+
+    def stored_newlines(self, entry_id, chunk_size=1 << 20):
+        """Число переводов строк несжатого элемента (с проверкой CRC), считается один раз.
+
+        Данные читаются из файла, а не через отображение: прочитанные страницы
+        отображения остаются в памяти процесса, и tail большого файла занимал бы
+        память размером с сам файл.
+        """
+        newlines = self.stored_lines.get(entry_id)
+        if newlines is not None:
+            return newlines
+        crc = 0
+        newlines = 0
+        with open(self.vfs_path, 'rb', buffering=0) as f:
+            f.seek(self.data_offset(entry_id))
+            remaining = self.entries.file_size(entry_id)
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                crc = zlib.crc32(chunk, crc)
+                newlines += chunk.count(b'\n')
+        self._check_crc(entry_id, crc if not remaining else None)
+        self.stored_lines[entry_id] = newlines
+        return newlines
+
+    def iter_chunks(self, entry_id, chunk_size=65536):
+        """Генератор блоков байтов элемента (срезы отображения или потоковая распаковка)"""
+        view = self.mapped_view(entry_id)
+        mapped = view is not None
+        if view is None:
+            data = self.cached_content(entry_id)
+            if data is not None:
+                view = memoryview(data)
+        if view is not None:
+            # У несжатого элемента CRC считается по мере выдачи блоков и сверяется
+            # в конце, как в ZipExtFile; содержимое кэша уже проверил zipfile
+            crc = 0 if mapped and entry_id not in self.crc_verified else None
+            for start in range(0, len(view), chunk_size):
+                chunk = view[start:start + chunk_size]
+                if crc is not None:
+                    crc = zlib.crc32(chunk, crc)
+                yield chunk
+            if crc is not None:
+                self._check_crc(entry_id, crc)
+            return
+
+        with self.archive.open(self.entries[entry_id]) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                self.bytes_decompressed += len(chunk)
+                yield chunk
+
+    def iter_text(self, filename, chunk_size=65536):
+        """Генератор декодированных блоков текста файла; None, если файл не найден"""
+        if not self.archive:
+            return None
+
+        entry_id = self.index.get_file(self.resolve_path(filename))
+        if entry_id is None:
+            return None
+        return self._iter_text(entry_id, chunk_size)
+
+    def _iter_text(self, entry_id, chunk_size):
+        # Инкрементальный декодер корректно склеивает символы, разрезанные границей блока
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for chunk in self.iter_chunks(entry_id, chunk_size):
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
+
+    def tail_lines(self, filename, count, chunk_size=65536):
+        """Номер первой строки и последние count строк файла без чтения его целиком в память"""
+        if not self.archive:
+            return None
+
+        entry_id = self.index.get_file(self.resolve_path(filename))
+        if entry_id is None:
             return None
 
+        try:
+            view = self.mapped_view(entry_id)
+            if view is not None:
+                first, lines = self._tail_mapped(view, self.stored_newlines(entry_id), count, chunk_size)
+            else:
+                first, lines = self._tail_stream(entry_id, count, chunk_size)
+            # Границы строк в UTF-8 не попадают внутрь многобайтовых символов
+            return first, [line.decode('utf-8') for line in lines]
+        except UnicodeDecodeError:
+            self.echo(f"Файл '{filename}' содержит бинарные данные и не может быть прочитан как текст")
+            return None
+        except Exception as e:
+            self.echo(f"Ошибка чтения файла: {e}")
+            return None
+
+    @staticmethod
+    def _tail_mapped(view, total_newlines, count, chunk_size):
+        """Чтение несжатого элемента с конца блоками до count переводов строк"""
+        pos = len(view)
+        newlines = 0
+        while pos > 0 and newlines < count:
+            start = max(0, pos - chunk_size)
+            newlines += view[start:pos].tobytes().count(b'\n')
+            pos = start
+
+        pieces = view[pos:].tobytes().split(b'\n')
+        lines = pieces[-count:]
+
+        # Число переводов строк во всем элементе посчитано при проверке CRC
+        return total_newlines + 2 - len(lines), lines
+
+    def _tail_stream(self, entry_id, count, chunk_size):
+        """Потоковая распаковка сжатого элемента с хранением только последних count строк"""
+        lines = deque(maxlen=count)
+        total = 0
+        carry = b''
+        for chunk in self.iter_chunks(entry_id, chunk_size):
+            pieces = (carry + chunk).split(b'\n')
+            carry = pieces.pop()
+            total += len(pieces)
+            lines.extend(pieces)
+        lines.append(carry)
+        total += 1
+        return total - len(lines) + 1, list(lines)
+
+    def data_offset(self, entry_id):
+        """Смещение данных элемента в архиве (после локального заголовка)"""
+        offset = self.data_offsets.get(entry_id)
+        if offset is None:
+            header_offset = self.entries.header_offset(entry_id)
+            header = _LOCAL_HEADER.unpack_from(self.mapping, header_offset)
+            if header[0] != zipfile.stringFileHeader:
+                raise zipfile.BadZipFile("Bad magic number for file header")
+            name_len, extra_len = header[10], header[11]
+            offset = header_offset + _LOCAL_HEADER.size + name_len + extra_len
+            self.data_offsets[entry_id] = offset
+        return offset
+
     def file_exists(self, filename):
         """Проверка существования файла"""
         if not self.archive:
             return False
 
-        if filename.startswith('/'):
-            full_path = filename.lstrip('/')
+        return self.index.get_file(self.resolve_path(filename)) is not None
+
+
+# Методы сжатия, которые читаются напрямую из архива без zipfile
+_STREAM_METHODS = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2)
+
+
+def _bounded_decompress(decompressor, data, max_length):
+    """Распаковка блока частями не больше max_length: хорошо сжимаемый блок не раздувается в памяти"""
+    if isinstance(decompressor, bz2.BZ2Decompressor):
+        # bz2 хранит необработанный остаток входа у себя
+        chunk = decompressor.decompress(data, max_length)
+        while True:
+            if chunk:
+                yield chunk
+            if decompressor.eof or decompressor.needs_input:
+                return
+            chunk = decompressor.decompress(b'', max_length)
+    while True:
+        chunk = decompressor.decompress(data, max_length)
+        data = decompressor.unconsumed_tail
+        if chunk:
+            yield chunk
+        # Неполный выход без остатка входа - блок распакован целиком
+        if not data and len(chunk) < max_length:
+            return
+
+
+def _iter_member_chunks(handle, header_offset, method, compress_size, chunk_size=1 << 20):
+    """Генератор распакованных блоков элемента по смещению его локального заголовка"""
+    if method == zipfile.ZIP_STORED:
+        decompressor = None
+    elif method == zipfile.ZIP_DEFLATED:
+        decompressor = zlib.decompressobj(-15)
+    else:
+        decompressor = bz2.BZ2Decompressor()
+
+    handle.seek(header_offset)
+    header = handle.read(_LOCAL_HEADER.size)
+    if len(header) != _LOCAL_HEADER.size:
+        raise ValueError("обрезан локальный заголовок")
+    header = _LOCAL_HEADER.unpack(header)
+    if header[0] != zipfile.stringFileHeader:
+        raise ValueError("неверная сигнатура локального заголовка")
+    handle.seek(header_offset + _LOCAL_HEADER.size + header[10] + header[11])
+
+    remaining = compress_size
+    while remaining > 0:
+        chunk = handle.read(min(chunk_size, remaining))
+        if not chunk:
+            raise ValueError("данные обрезаны")
+        remaining -= len(chunk)
+        if decompressor is None:
+            yield chunk
         else:
-            full_path = os.path.join(self.current_dir.lstrip('/'), filename).replace('\\', '/')
+            yield from _bounded_decompress(decompressor, chunk, chunk_size)
+    if method == zipfile.ZIP_DEFLATED:
+        yield decompressor.flush()
+        if not decompressor.eof:
+            raise ValueError("поток deflate не завершен")
+
+
+class ArchiveVerifier:
+    """Параллельная проверка CRC-32 всех элементов архива.
+
+    zlib освобождает GIL при распаковке и подсчете CRC, поэтому пул потоков
+    дает настоящий параллелизм; у каждого потока свой дескриптор файла.
+    Элементы обрабатываются пачками в порядке смещений в архиве.
+    """
+
+    BATCH_BYTES = 64 << 20
+    BATCH_MEMBERS = 512
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, vfs, workers=None):
+        self.vfs = vfs
+        self.workers = workers or os.cpu_count() or 1
+        self.local = threading.local()
+        self.handles = []
+        self.handles_lock = threading.Lock()
+
+    def run(self):
+        """Проверка всех файлов архива; словарь с итогами и списком поврежденных элементов"""
+        table = self.vfs.entries
+        entry_ids = [entry_id for entry_id in range(len(table)) if not table.name(entry_id).endswith('/')]
+        entry_ids.sort(key=table.header_offset)
+
+        batches = []
+        batch, batch_bytes = [], 0
+        for entry_id in entry_ids:
+            batch.append(entry_id)
+            batch_bytes += table.compress_size(entry_id)
+            if len(batch) >= self.BATCH_MEMBERS or batch_bytes >= self.BATCH_BYTES:
+                batches.append(batch)
+                batch, batch_bytes = [], 0
+        if batch:
+            batches.append(batch)
+
+        result = {'members': 0, 'bytes': 0, 'skipped': 0, 'corrupt': []}
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for checked, size, skipped, corrupt, unpacked in pool.map(self._verify_batch, batches):
+                    result['members'] += checked
+                    result['bytes'] += size
+                    result['skipped'] += skipped
+                    result['corrupt'].extend(corrupt)
+                    self.vfs.bytes_decompressed += unpacked
+        finally:
+            for handle in self.handles:
+                handle.close()
+        result['seconds'] = time.perf_counter() - started
+        result['workers'] = self.workers
+        return result
+
+    def _handle(self):
+        """Собственный дескриптор архива для текущего потока"""
+        handle = getattr(self.local, 'handle', None)
+        if handle is None:
+            handle = self.local.handle = open(self.vfs.vfs_path, 'rb')
+            with self.handles_lock:
+                self.handles.append(handle)
+        return handle
+
+    def _verify_batch(self, batch):
+        handle = self._handle()
+        table = self.vfs.entries
+        checked = size = skipped = unpacked = 0
+        corrupt = []
+        for entry_id in batch:
+            # Зашифрованные элементы без пароля проверить нельзя
+            if table.flag_bits(entry_id) & 0x1:
+                skipped += 1
+                continue
+            try:
+                member_size = self._verify_member(handle, entry_id)
+            except Exception as e:
+                corrupt.append((table.name(entry_id), str(e)))
+            else:
+                size += member_size
+                if table.compress_type(entry_id) != zipfile.ZIP_STORED:
+                    unpacked += member_size
+            checked += 1
+        return checked, size, skipped, corrupt, unpacked
+
+    def _verify_member(self, handle, entry_id):
+        """Распаковка элемента со сверкой CRC-32 и размера; возвращает распакованный объем"""
+        table = self.vfs.entries
+        method = table.compress_type(entry_id)
+        if method not in _STREAM_METHODS:
+            # Редкие методы (LZMA и др.) - через zipfile с общим дескриптором
+            return self._verify_with_zipfile(entry_id)
+
+        crc = 0
+        size = 0
+        for chunk in _iter_member_chunks(handle, table.header_offset(entry_id), method,
+                                         table.compress_size(entry_id), self.CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+
+        if size != table.file_size(entry_id):
+            raise ValueError(f"размер {size} вместо {table.file_size(entry_id)}")
+        if crc != table.crc(entry_id):
+            raise ValueError(f"CRC-32 {crc:08x} вместо {table.crc(entry_id):08x}")
+        return size
+
+    def _verify_with_zipfile(self, entry_id):
+        table = self.vfs.entries
+        crc = 0
+        size = 0
+        with self.vfs.archive.open(table[entry_id]) as f:
+            while True:
+                chunk = f.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+        if crc != table.crc(entry_id):
+            raise ValueError(f"CRC-32 {crc:08x} вместо {table.crc(entry_id):08x}")
+        return size
+
+
+# Состояние исполнителя grep (процесс пула или поток сессии сервера):
+# открытый архив (ключ, дескриптор, ZipFile для редких методов)
+_grep_local = threading.local()
+
+
+def _grep_chunks(vfs_path, name, header_offset, method, compress_size):
+    """Блоки элемента у исполнителя; дескриптор архива открывается один раз на процесс и поток"""
+    state = _grep_local.__dict__
+    # PID в ключе: после fork дескриптор родителя разделяет с ним позицию чтения
+    key = (vfs_path, os.getpid())
+    if state.get('key') != key:
+        for field in ('handle', 'zipfile'):
+            if state.get(field) is not None:
+                state[field].close()
+        state.update(key=key, handle=open(vfs_path, 'rb'), zipfile=None)
+    if method in _STREAM_METHODS:
+        return _iter_member_chunks(state['handle'], header_offset, method, compress_size)
+
+    if state['zipfile'] is None:
+        state['zipfile'] = zipfile.ZipFile(vfs_path)
+
+    def read_zipfile():
+        with state['zipfile'].open(name) as f:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                yield chunk
+    return read_zipfile()
+
+
+def _grep_member(task):
+    """Поиск по одному элементу: (совпадения [(номер строки, строка)], двоичный?, ошибка, распаковано байт)"""
+    vfs_path, name, header_offset, method, compress_size, flag_bits, pattern, flags, expected_crc = task
+    # Зашифрованные элементы без пароля не читаются
+    if flag_bits & 0x1:
+        return [], False, "файл зашифрован", 0
+    # MULTILINE: ^ и $ в поиске по блоку срабатывают на границах строк, как в поиске по строке
+    search = re.compile(pattern, flags | re.MULTILINE).search
+    matches = []
+    binary = False
+    line_number = 0
+    carry = b''
+    # Прямое чтение элемента CRC не проверяет (zipfile для редких методов проверяет сам)
+    crc = 0 if method in _STREAM_METHODS else None
+    unpacked = 0
+    try:
+        for chunk in chain(_grep_chunks(vfs_path, name, header_offset, method, compress_size), [None]):
+            if chunk is None:
+                if crc is not None and crc != expected_crc:
+                    return [], False, f"Bad CRC-32 for file {name!r}", unpacked
+                # Последняя строка без перевода строки
+                if not carry:
+                    break
+                block, carry = carry, b''
+            else:
+                if crc is not None:
+                    crc = zlib.crc32(chunk, crc)
+                if method != zipfile.ZIP_STORED:
+                    unpacked += len(chunk)
+                block = carry + chunk
+                cut = block.rfind(b'\n')
+                if cut < 0:
+                    carry = block
+                    continue
+                block, carry = block[:cut], block[cut + 1:]
+
+            binary = binary or b'\0' in block
+            text = block.decode('utf-8', 'replace')
+            # Сначала один поиск по всему блоку: блоки без совпадений не режутся на строки
+            if search(text) is None:
+                line_number += text.count('\n') + 1
+                continue
+            lines = text.split('\n')
+            matches.extend((number, line) for number, line in enumerate(lines, line_number + 1)
+                           if search(line))
+            line_number += len(lines)
+            # Для двоичного файла достаточно факта совпадения
+            if binary and matches:
+                return [], True, None, unpacked
+    except Exception as e:
+        return [], False, str(e), unpacked
+    return matches, binary and bool(matches), None, unpacked
+
+
+class ContentSearcher:
+    """Параллельный поиск по содержимому элементов архива в пуле процессов.
+
+    Регулярные выражения держат GIL, поэтому нужны процессы, а не потоки.
+    Каждый элемент - отдельная задача; задачи отправляются в порядке смещений
+    в архиве (последовательное чтение диска), результаты приходят в том же порядке.
+    """
+
+    # Меньший объем ищется в текущем процессе: запуск пула дороже самого поиска
+    INLINE_BYTES = 4 << 20
+
+    def __init__(self, vfs, workers=None, mp_context=None):
+        self.vfs = vfs
+        self.workers = workers or os.cpu_count() or 1
+        # Способ запуска процессов пула (None - по умолчанию для платформы)
+        self.mp_context = mp_context
+        self.pool = None
+
+    def start(self):
+        """Создание пула процессов, если его еще нет"""
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=self.mp_context)
+
+    def search(self, entry_ids, pattern, flags=0, vfs=None):
+        """Генератор (номер элемента, совпадения, двоичный?, ошибка) в порядке смещений в архиве.
+
+        Распакованный объем добавляется к счетчику vfs - представления сессии,
+        которая ищет (по умолчанию VFS, к которой привязан поиск).
+        """
+        vfs = vfs or self.vfs
+        table = self.vfs.entries
+        # С полнотекстовым индексом распаковываются только элементы-кандидаты
+        text_index = self.vfs.get_text_index()
+        candidates = text_index.candidates(pattern, flags) if text_index is not None else None
+        if candidates is not None:
+            entry_ids = [entry_id for entry_id in entry_ids if entry_id in candidates]
+        entry_ids = sorted(entry_ids, key=table.header_offset)
+        tasks = []
+        for entry_id in entry_ids:
+            tasks.append((self.vfs.vfs_path, table.name(entry_id), table.header_offset(entry_id),
+                          table.compress_type(entry_id), table.compress_size(entry_id),
+                          table.flag_bits(entry_id), pattern, flags, table.crc(entry_id)))
+
+        total = sum(task[4] for task in tasks)
+        if len(tasks) <= 1 or self.workers == 1 or total < self.INLINE_BYTES:
+            results = map(_grep_member, tasks)
+        else:
+            self.start()
+            # Мелкие элементы передаются исполнителям пачками, чтобы не платить за IPC на каждый
+            chunksize = max(1, min(64, len(tasks) // (self.workers * 4)))
+            results = self.pool.map(_grep_member, tasks, chunksize=chunksize)
+
+        for entry_id, (matches, binary, error, unpacked) in zip(entry_ids, results):
+            vfs.bytes_decompressed += unpacked
+            yield entry_id, matches, binary, error
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+class TrigramIndex:
+    """Полнотекстовый триграммный индекс текстовых элементов архива (файл <vfs>.fts).
+
+    Для каждой триграммы текста со свернутым регистром (fold) хранится массив номеров элементов.
+    Из регулярного выражения извлекаются обязательные строки; кандидатами остаются
+    элементы со всеми их триграммами и неиндексированные элементы (двоичные, не UTF-8,
+    слишком большие, зашифрованные), которые приходится проверять всегда.
+    """
+
+    VERSION = 2
+    SUFFIX = '.fts'
+    # Точечная и бесточечная i, которые re.IGNORECASE считает равными i, а casefold() - нет
+    FOLD_FIXES = {0x130: 'i', 0x131: 'i'}
+    # Элементы больше этого размера не индексируются
+    MAX_MEMBER_BYTES = 64 << 20
+
+    def __init__(self, postings, unindexed, members):
+        # Триграмма -> номера элементов (байты массива 'I', так индекс хранится в файле)
+        self.postings = postings
+        self.unindexed = unindexed
+        self.members = members
+
+    @classmethod
+    def build(cls, vfs, chunk_size=1 << 20):
+        """Построение индекса чтением всех файлов архива в порядке смещений"""
+        table = vfs.entries
+        entry_ids = [entry_id for entry_id in range(len(table)) if not table.name(entry_id).endswith('/')]
+        entry_ids.sort(key=table.header_offset)
+        postings = {}
+        unindexed = array('I')
+        with open(vfs.vfs_path, 'rb') as handle:
+            for entry_id in entry_ids:
+                grams = cls._member_trigrams(vfs, handle, entry_id, chunk_size)
+                if grams is None:
+                    unindexed.append(entry_id)
+                    continue
+                for gram in grams:
+                    ids = postings.get(gram)
+                    if ids is None:
+                        ids = postings[gram] = array('I')
+                    ids.append(entry_id)
+        return cls({gram: ids.tobytes() for gram, ids in postings.items()}, unindexed, len(entry_ids))
+
+    @classmethod
+    def fold(cls, text):
+        """Свертка регистра посимвольно и без учета контекста: символы, равные при
+        re.IGNORECASE (сигма и конечная сигма, ſ и s, знак Кельвина и K), совпадают"""
+        return text.translate(cls.FOLD_FIXES).casefold()
+
+    @classmethod
+    def _member_trigrams(cls, vfs, handle, entry_id, chunk_size):
+        """Триграммы текста элемента; None, если элемент не индексируется"""
+        table = vfs.entries
+        if table.flag_bits(entry_id) & 0x1 or table.file_size(entry_id) > cls.MAX_MEMBER_BYTES:
+            return None
+        method = table.compress_type(entry_id)
+        if method in _STREAM_METHODS:
+            chunks = _iter_member_chunks(handle, table.header_offset(entry_id), method,
+                                         table.compress_size(entry_id), chunk_size)
+        else:
+            chunks = vfs.iter_chunks(entry_id, chunk_size)
 
-        return full_path in self.archive.namelist()
+        # Прямая распаковка в счетчик VFS не попадает (в отличие от iter_chunks) - считаем сами
+        counted = method in _STREAM_METHODS and method != zipfile.ZIP_STORED
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        grams = set()
+        carry = ''
+        try:
+            for chunk in chain(chunks, [None]):
+                if counted and chunk is not None:
+                    vfs.bytes_decompressed += len(chunk)
+                text = decoder.decode(b'', final=True) if chunk is None else decoder.decode(chunk)
+                if '\0' in text:
+                    return None
+                # Два последних символа блока переносятся, чтобы не потерять триграммы на стыке
+                text = carry + cls.fold(text)
+                grams.update([text[i:i + 3] for i in range(len(text) - 2)])
+                carry = text[-2:]
+        except Exception:
+            return None
+        return grams
+
+    def candidates(self, pattern, flags=0):
+        """Номера элементов, где возможно совпадение; None, если в выражении нет строк от 3 символов"""
+        grams = set()
+        for literal in self.required_literals(pattern, flags):
+            literal = self.fold(literal)
+            grams.update(literal[i:i + 3] for i in range(len(literal) - 2))
+        if not grams:
+            return None
+
+        result = None
+        # Пересечение начинается с самой редкой триграммы
+        for gram in sorted(grams, key=lambda gram: len(self.postings.get(gram, b''))):
+            ids = array('I')
+            ids.frombytes(self.postings.get(gram, b''))
+            result = set(ids) if result is None else result.intersection(ids)
+            if not result:
+                break
+        result.update(self.unindexed)
+        return result
+
+    @classmethod
+    def required_literals(cls, pattern, flags=0):
+        """Строки, входящие в любое совпадение регулярного выражения"""
+        try:
+            return cls._sequence_literals(_sre_parse.parse(pattern, flags))
+        except Exception:
+            return []
+
+    @classmethod
+    def _sequence_literals(cls, items):
+        # Подряд идущие символы образуют строку; группы и повторы от одного раза обязательны
+        # целиком, альтернативы и необязательные части обрывают строку
+        literals, run = [], []
+        for op, value in items:
+            if op == _sre_parse.LITERAL:
+                run.append(chr(value))
+                continue
+            if run:
+                literals.append(''.join(run))
+                run = []
+            if op == _sre_parse.SUBPATTERN:
+                literals.extend(cls._sequence_literals(value[-1]))
+            elif op in (_sre_parse.MAX_REPEAT, _sre_parse.MIN_REPEAT) and value[0] >= 1:
+                literals.extend(cls._sequence_literals(value[2]))
+        if run:
+            literals.append(''.join(run))
+        return literals
+
+    def save(self, path, key):
+        """Запись индекса через временный файл"""
+        with open(path + '.tmp', 'wb') as f:
+            marshal.dump((self.VERSION, key, self.members, self.postings, self.unindexed.tobytes()), f)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, key):
+        """Чтение индекса; None, если файл поврежден или построен для другой версии архива"""
+        try:
+            with open(path, 'rb') as f:
+                version, saved_key, members, postings, unindexed_bytes = marshal.load(f)
+        except Exception:
+            return None
+        if version != cls.VERSION or saved_key != key:
+            return None
+        unindexed = array('I')
+        unindexed.frombytes(unindexed_bytes)
+        return cls(postings, unindexed, members)
+
+
+class ShellOutput:
+    """Буферизованный вывод команд: строки копятся и пишутся в stdout крупными блоками"""
+
+    def __init__(self, stream=None, buffer_size=1 << 16, interactive=True):
+        # stream - бинарный поток; по умолчанию sys.stdout.buffer на момент записи
+        self.stream = stream
+        self.buffer_size = buffer_size
+        # В интерактивном режиме вывод сбрасывается после каждой команды
+        self.interactive = interactive
+        self.parts = []
+        self.size = 0
+        self.last_flush = time.perf_counter()
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def line(self, text=''):
+        self.write(f"{text}\n")
+
+    def end_command(self):
+        """Конец команды: в интерактивном режиме вывод сразу отправляется на экран"""
+        if self.interactive:
+            self.flush()
+
+    def flush_if_stale(self, interval=0.1):
+        """Промежуточный сброс для долгих команд: в интерактивном режиме не реже раза в interval секунд"""
+        if self.interactive and self.parts and time.perf_counter() - self.last_flush >= interval:
+            self.flush()
+
+    def flush(self):
+        if not self.parts:
+            return
+        text = ''.join(self.parts)
+        self.parts.clear()
+        self.size = 0
+        self.last_flush = time.perf_counter()
+
+        stream = self.stream
+        if stream is None:
+            # Сначала выводим то, что успело попасть в текстовый буфер через print()
+            sys.stdout.flush()
+            stream = getattr(sys.stdout, 'buffer', None)
+            if stream is None:
+                # stdout подменен текстовым потоком (например, StringIO)
+                sys.stdout.write(text)
+                return
+            encoding = sys.stdout.encoding or 'utf-8'
+            errors = sys.stdout.errors or 'strict'
+        else:
+            encoding, errors = 'utf-8', 'replace'
+        stream.write(text.encode(encoding, errors))
+        stream.flush()
+
+
+class Command:
+    """Команда оболочки: обработчик, псевдонимы и спецификация аргументов.
+
+    Обработчик - функция (shell, args), при ошибке она возвращает False.
+    Вместо обработчика можно передать loader, который вернет его при первом
+    вызове команды (ленивая регистрация).
+    """
+
+    def __init__(self, name, handler=None, aliases=(), min_args=0, max_args=None,
+                 usage=None, example=None, description='', loader=None):
+        self.name = name
+        self.handler = handler
+        self.loader = loader
+        self.aliases = tuple(aliases)
+        self.min_args = min_args
+        self.max_args = max_args
+        self.usage = usage or name
+        self.example = example
+        self.description = description
+
+    def synopsis(self):
+        """Строка для справки: использование и псевдонимы"""
+        if not self.aliases:
+            return self.usage
+        return '/'.join((self.usage,) + self.aliases)
+
+    def run(self, shell, args):
+        if (len(args) < self.min_args
+                or (self.max_args is not None and len(args) > self.max_args)):
+            shell.out.line(f"Использование: {self.usage}")
+            if self.example:
+                shell.out.line(f"Пример: {self.example}")
+            return False
+        if self.handler is None:
+            self.handler = self.loader()
+        return self.handler(shell, args)
+
+
+# Реестр команд: имя или псевдоним -> Command
+COMMANDS = {}
+
+
+def register_command(command):
+    """Регистрация команды под основным именем и всеми псевдонимами"""
+    for name in (command.name,) + command.aliases:
+        COMMANDS[name] = command
+    return command
 
 
 class ShellEmulator:
-    def __init__(self, vfs_path=None, script_path=None):
-        self.vfs = VirtualFileSystem(vfs_path)
+    # Реестр общий для всех экземпляров оболочки
+    commands = COMMANDS
+
+    # Сколько горячих функций и мест выделения памяти показывать в профиле
+    PROFILE_TOP = 15
+
+    # Разобранные скрипты по хешу содержимого (общие для всех экземпляров оболочки)
+    script_cache = OrderedDict()
+    script_cache_lock = threading.Lock()
+    SCRIPT_CACHE_SIZE = 4
+    # Предел строк во всех скриптах кэша вместе (разбор строки занимает ~360 байт, до ~36 МБ);
+    # более длинные скрипты выполняются потоково без сохранения разбора
+    SCRIPT_CACHE_LINES = 100000
+
+    def __init__(self, vfs_path=None, script_path=None, profile=False, profile_memory=False,
+                 quiet_script=False, vfs=None, **vfs_options):
+        # Готовая VFS передается сессиям сервера, иначе архив открывается здесь
+        self.vfs = vfs if vfs is not None else VirtualFileSystem(vfs_path, **vfs_options)
+        self.out = ShellOutput()
+        self.vfs.echo = self.out.line
         self.script_path = script_path
+        # Стартовый скрипт без эха строк
+        self.quiet_script = quiet_script
+        # Профилирование каждой команды (--profile), отчеты пишутся в stderr
+        self.profile = profile
+        self.profile_memory = profile_memory
+        # Задержки команд по имени команды
+        self.latencies = {}
+        # Цветные имена в ls (в пакетном режиме отключаются)
+        self.colors = True
+        # Сессия сервера: вывод уходит клиенту, а не в терминал процесса
+        self.remote = False
         self.history = []
         self.start_time = datetime.now()
         self.username = getpass.getuser()
@@ -199,230 +1992,742 @@ class ShellEmulator:
         current_dir = self.vfs.current_dir if self.vfs.current_dir != '/' else '/'
         return f"{vfs_name}:{current_dir}> "
 
-    def execute_script(self, script_path):
-        """Выполнение стартового скрипта"""
+    def execute_script(self, script_path, quiet=False):
+        """Выполнение скрипта: строки разбираются один раз, разбор кэшируется по хешу содержимого.
+
+        Файл читается потоково; quiet отключает эхо строк и разделители - выводится
+        только вывод команд.
+        """
         if not os.path.exists(script_path):
-            print(f"Скрипт '{script_path}' не найден")
+            self.out.line(f"Скрипт '{script_path}' не найден")
             return False
 
+        # Во время скрипта вывод сбрасывается только при заполнении буфера
+        interactive = self.out.interactive
+        self.out.interactive = False
         try:
-            with open(script_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-
-            print(f"Выполнение скрипта: {script_path}")
-            print("-" * 50)
-
-            for line_num, line in enumerate(lines, 1):
-                line = line.strip()
-
-                # Пропуск пустых строк и комментариев
-                if not line:
-                    print(f"[{line_num}] # пустая строка")
-                    continue
-                elif line.startswith('#'):
-                    print(f"[{line_num}] # {line[1:].strip()}")
-                    continue
-
-                # Отображение ввода
-                print(f"[{line_num}] {line}")
-
-                # Выполнение команды
-                self.execute_command(line)
-
-                print()  # Пустая строка для разделения
+            if not quiet:
+                self.out.line(f"Выполнение скрипта: {script_path}")
+                self.out.line("-" * 50)
+
+            digest = self._file_digest(script_path)
+            with self.script_cache_lock:
+                commands = self.script_cache.get(digest)
+                if commands is not None:
+                    self.script_cache.move_to_end(digest)
+            if commands is not None:
+                for command in commands:
+                    self._run_script_command(command, quiet)
+            else:
+                self._run_script_file(script_path, digest, quiet)
 
-            print("-" * 50)
-            print("Скрипт выполнен успешно")
+            if not quiet:
+                self.out.line("-" * 50)
+                self.out.line("Скрипт выполнен успешно")
             return True
 
         except Exception as e:
-            print(f"Ошибка выполнения скрипта: {e}")
+            self.out.line(f"Ошибка выполнения скрипта: {e}")
             return False
+        finally:
+            self.out.interactive = interactive
+            self.out.flush()
+
+    def _run_script_file(self, script_path, digest, quiet):
+        """Потоковые чтение, разбор и выполнение скрипта; разобранные команды попадают в кэш"""
+        commands = []
+        with open(script_path, 'r', encoding='utf-8') as f:
+            for command in self.parse_script(f):
+                self._run_script_command(command, quiet)
+                if commands is not None:
+                    commands.append(command)
+                    if len(commands) > self.SCRIPT_CACHE_LINES:
+                        commands = None
+        # Файл мог измениться во время выполнения - тогда разбор не соответствует хешу
+        if commands is not None and self._file_digest(script_path) == digest:
+            with self.script_cache_lock:
+                self.script_cache[digest] = commands
+                # Старые скрипты вытесняются, пока кэш не уложится в оба предела
+                while (len(self.script_cache) > self.SCRIPT_CACHE_SIZE
+                       or sum(map(len, self.script_cache.values())) > self.SCRIPT_CACHE_LINES):
+                    self.script_cache.popitem(last=False)
+
+    @staticmethod
+    def _file_digest(path, chunk_size=1 << 20):
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return digest.digest()
+                digest.update(chunk)
+
+    def parse_script(self, lines):
+        """Разбор строк скрипта в (номер строки, текст, аргументы, команда реестра).
+
+        У пустых строк и комментариев аргументы None; неизвестная команда - None.
+        """
+        resolve = self.resolve_command
+        for line_num, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                yield line_num, line, None, None
+            else:
+                args = line.split()
+                yield line_num, line, args, resolve(args[0])
+
+    def _run_script_command(self, command, quiet):
+        line_num, line, args, entry = command
+        if args is None:
+            if not quiet:
+                if line:
+                    self.out.line(f"[{line_num}] # {line[1:].strip()}")
+                else:
+                    self.out.line(f"[{line_num}] # пустая строка")
+            return True
+
+        # Отображение ввода
+        if not quiet:
+            self.out.line(f"[{line_num}] {line}")
+        ok = self.run_parsed(line, args, entry)
+        if not quiet:
+            self.out.line()  # Пустая строка для разделения
+        return ok
 
     def execute_command(self, command):
-        """Выполнение одной команды"""
+        """Выполнение одной команды; False, если команда завершилась ошибкой"""
         command = command.strip()
         if not command:
-            return
+            return True
+
+        return self.run_parsed(command, command.split())
 
+    def run_parsed(self, command, args, entry=None):
+        """Выполнение разобранной команды: текст для истории, аргументы и, если известна, команда реестра"""
         # Добавление в историю
         self.history.append(command)
 
-        args = command.split()
-        cmd = args[0].lower()
-
+        if self.profile:
+            ok, report = self.profile_call(args, self.profile_memory, entry)
+            self.out.flush()
+            sys.stderr.write(report)
+            sys.stderr.flush()
+            return ok
+        return self.dispatch(args, entry)
+
+    def resolve_command(self, name):
+        """Команда реестра по имени или псевдониму (без учета регистра); None, если нет"""
+        # Один поиск в словаре; приведение к нижнему регистру только при промахе
+        return self.commands.get(name) or self.commands.get(name.lower())
+
+    def dispatch(self, args, entry=None):
+        """Поиск команды в реестре (если она не передана уже найденной) и ее выполнение; False при ошибке"""
+        name = args[0]
+        entry = entry or self.resolve_command(name)
+
+        started = time.perf_counter()
         try:
-            if cmd == 'ls':
-                self.cmd_ls(args[1:])
-            elif cmd == 'cd':
-                self.cmd_cd(args[1:])
-            elif cmd == 'whoami':
-                self.cmd_whoami()
-            elif cmd == 'tail':
-                self.cmd_tail(args[1:])
-            elif cmd == 'vfs-info':
-                self.cmd_vfs_info()
-            elif cmd == 'history':
-                self.cmd_history()
-            elif cmd == 'cat':
-                self.cmd_cat(args[1:])
-            elif cmd == 'pwd':
-                self.cmd_pwd()
-            elif cmd == 'help':
-                self.cmd_help()
-            elif cmd == 'exit' or cmd == 'quit':
-                print("Выход из эмулятора...")
-                sys.exit(0)
-            elif cmd == 'clear' or cmd == 'clr':
-                self.cmd_clear()
-            else:
-                print(f"Команда '{cmd}' не найдена. Введите 'help' для списка команд.")
+            if entry is None:
+                self.out.line(f"Команда '{name.lower()}' не найдена. Введите 'help' для списка команд.")
+                return False
+            return entry.run(self, args[1:]) is not False
 
         except Exception as e:
-            print(f"Ошибка выполнения команды: {e}")
+            self.out.line(f"Ошибка выполнения команды: {e}")
+            return False
+        finally:
+            self.out.end_command()
+            if entry is not None:
+                histogram = self.latencies.get(entry.name)
+                if histogram is None:
+                    histogram = self.latencies[entry.name] = LatencyHistogram()
+                histogram.record(time.perf_counter() - started)
+
+    def profile_call(self, args, memory=False, entry=None):
+        """Выполнение команды под cProfile (и tracemalloc): ее результат и текст отчета о горячих местах"""
+        profiler = cProfile.Profile()
+        # При вложенном профилировании (profile -m под --profile-memory) трассировку
+        # запускает и останавливает только внешний вызов
+        own_tracing = memory and not tracemalloc.is_tracing()
+        if own_tracing:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            ok = profiler.runcall(self.dispatch, args, entry)
+        finally:
+            elapsed = time.perf_counter() - started
+            snapshot = None
+            if memory:
+                snapshot = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+            if own_tracing:
+                tracemalloc.stop()
+
+        report = io.StringIO()
+        report.write(f"=== Профиль команды '{' '.join(args)}': {elapsed:.4f} с ===\n")
+        stats = pstats.Stats(profiler, stream=report)
+        stats.strip_dirs().sort_stats('cumulative').print_stats(self.PROFILE_TOP)
+
+        if snapshot is not None:
+            report.write(f"=== Места выделения памяти (пик {peak / 1024:.1f} КБ) ===\n")
+            # Выделения самого профилировщика в отчет не попадают
+            snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                               tracemalloc.Filter(False, cProfile.__file__)))
+            for stat in snapshot.statistics('lineno')[:self.PROFILE_TOP]:
+                report.write(f"  {stat}\n")
+        return ok, report.getvalue()
+
+    def cmd_profile(self, args):
+        """Команда profile - профилирование одной команды"""
+        memory = args[0] == '-m'
+        if memory:
+            args = args[1:]
+        if not args:
+            self.out.line("Использование: profile [-m] <cmd>")
+            return False
+        ok, report = self.profile_call(args, memory)
+        self.out.write(report)
+        return ok
 
     def cmd_ls(self, args):
-        """Команда ls"""
-        directory = args[0] if args else None
-        files = self.vfs.list_files(directory)
+        """Команда ls: -l - подробно, -a - со скрытыми, -S/-t - по размеру/времени, -r - в обратном порядке"""
+        options = ''
+        directory = None
+        for arg in args:
+            if re.fullmatch(r'-[laStr]+', arg):
+                options += arg[1:]
+            elif directory is None:
+                directory = arg
+            else:
+                self.out.line("Использование: ls [-l] [-a] [-S] [-t] [-r] [dir]")
+                return False
 
-        if files is None:
-            print("VFS не загружена")
-            return
+        sort_by = 'size' if 'S' in options else 'mtime' if 't' in options else 'name'
+        entries = self.vfs.list_entries(directory, sort_by, 'r' in options, 'a' in options)
 
-        if not files:
-            print("Директория пуста")
+        if entries is None:
+            self.out.line("VFS не загружена")
+            return False
+
+        if not entries:
+            if not self.vfs.is_directory(directory):
+                self.out.line(f"Директория '{directory}' не найдена")
+                return False
+            self.out.line("Директория пуста")
             return
 
-        for item in files:
-            # Определяем тип (файл или директория)
-            full_path = os.path.join(self.vfs.current_dir.rstrip('/'), item).replace('\\', '/')
-            if full_path + '/' in self.vfs.archive.namelist() or any(
-                name.startswith(full_path + '/') for name in self.vfs.archive.namelist()):
-                print(f"\033[94m{item}/\033[0m")  # Синий для директорий
-            else:
-                # Цвета для разных типов файлов
-                if item.endswith(('.py', '.sh', '.bat')):
-                    print(f"\033[92m{item}\033[0m")  # Зеленый для скриптов
-                elif item.endswith(('.txt', '.md', '.json', '.xml')):
-                    print(f"\033[93m{item}\033[0m")  # Желтый для текстовых файлов
-                else:
-                    print(item)  # Обычный цвет для остальных
+        if 'l' in options:
+            self.out.write(''.join([self._long_line(entry) for entry in entries]))
+            return
+        for entry in entries:
+            self.out.line(self._colored_name(entry))
+
+    def _colored_name(self, entry):
+        item = entry.name
+        if not self.colors:
+            return item + '/' if entry.is_dir else item
+        if entry.is_dir:
+            return f"\033[94m{item}/\033[0m"  # Синий для директорий
+        # Цвета для разных типов файлов
+        if item.endswith(('.py', '.sh', '.bat')):
+            return f"\033[92m{item}\033[0m"  # Зеленый для скриптов
+        if item.endswith(('.txt', '.md', '.json', '.xml')):
+            return f"\033[93m{item}\033[0m"  # Желтый для текстовых файлов
+        return item  # Обычный цвет для остальных
+
+    @staticmethod
+    def _file_mode(entry):
+        """Права в виде -rw-r--r--: unix-режим из старших бит external_attr или стандартные"""
+        mode = entry.external_attr >> 16
+        if not stat.S_IFMT(mode):
+            mode |= stat.S_IFDIR if entry.is_dir else stat.S_IFREG
+        if not mode & 0o7777:
+            mode |= 0o755 if entry.is_dir else 0o644
+            # Атрибут DOS "только чтение"
+            if entry.external_attr & 0x01:
+                mode &= ~0o222
+        return stat.filemode(mode)
+
+    def _long_line(self, entry):
+        """Строка ls -l: права, размер, сжатый размер, доля сжатого, время изменения и имя"""
+        if entry.is_dir:
+            return f"{self._file_mode(entry)} {'-':>10} {'-':>10} {'':>4} {'':16} {self._colored_name(entry)}\n"
+        ratio = f"{entry.compress_size / entry.size:.0%}" if entry.size else '-'
+        return (f"{self._file_mode(entry)} {entry.size:>10} {entry.compress_size:>10} {ratio:>4} "
+                f"{str(entry.mtime)[:16] if entry.mtime else '-':16} {self._colored_name(entry)}\n")
 
     def cmd_cd(self, args):
         """Команда cd"""
         if not args:
-            self.vfs.change_directory('/')
-        else:
-            self.vfs.change_directory(args[0])
+            return self.vfs.change_directory('/')
+        return self.vfs.change_directory(args[0])
 
-    def cmd_whoami(self):
+    def cmd_whoami(self, args=()):
         """Команда whoami - вывод текущего пользователя ОС"""
-        print(self.username)
+        self.out.line(self.username)
 
     def cmd_tail(self, args):
         """Команда tail - вывод последних строк файла"""
-        if not args:
-            print("Использование: tail <filename> [lines]")
-            print("Пример: tail readme.txt 5")
-            return
-
         filename = args[0]
         lines_count = 10
         if len(args) > 1:
             try:
                 lines_count = int(args[1])
                 if lines_count <= 0:
-                    print("Количество строк должно быть положительным числом")
-                    return
+                    self.out.line("Количество строк должно быть положительным числом")
+                    return False
             except ValueError:
-                print("Количество строк должно быть числом")
-                return
-
-        content = self.vfs.read_file(filename)
-        if content is None:
-            print(f"Файл '{filename}' не найден или недоступен для чтения")
-            return
+                self.out.line("Количество строк должно быть числом")
+                return False
 
-        all_lines = content.split('\n')
-        start_index = max(0, len(all_lines) - lines_count)
+        tail = self.vfs.tail_lines(filename, lines_count)
+        if tail is None:
+            self.out.line(f"Файл '{filename}' не найден или недоступен для чтения")
+            return False
 
-        print(f"=== Последние {lines_count} строк файла '{filename}' ===")
-        for i, line in enumerate(all_lines[start_index:], start_index + 1):
-            print(f"{i:4d}: {line}")
+        first_line, lines = tail
+        self.out.line(f"=== Последние {lines_count} строк файла '{filename}' ===")
+        for i, line in enumerate(lines, first_line):
+            self.out.line(f"{i:4d}: {line}")
 
     def cmd_cat(self, args):
         """Команда cat - вывод всего содержимого файла"""
-        if not args:
-            print("Использование: cat <filename>")
-            print("Пример: cat readme.txt")
-            return
-
         filename = args[0]
-        content = self.vfs.read_file(filename)
-        if content is None:
-            print(f"Файл '{filename}' не найден или недоступен для чтения")
+        chunks = self.vfs.iter_text(filename)
+        if chunks is None:
+            self.out.line(f"Файл '{filename}' не найден или недоступен для чтения")
+            return False
+
+        out = self.out
+        out.line(f"=== Содержимое файла '{filename}' ===")
+        # Строки выводятся по мере распаковки, незавершенная строка переносится в следующий блок
+        line_number = 1
+        carry = ''
+        try:
+            for text in chunks:
+                lines = (carry + text).split('\n')
+                carry = lines.pop()
+                # Один вызов записи на блок вместо вызова на каждую строку
+                out.write(''.join([f"{number:4d}: {line}\n"
+                                   for number, line in enumerate(lines, line_number)]))
+                line_number += len(lines)
+        except UnicodeDecodeError:
+            self.out.line(f"Файл '{filename}' содержит бинарные данные и не может быть прочитан как текст")
+            return False
+        self.out.line(f"{line_number:4d}: {carry}")
+
+    # Множители суффиксов размера в find
+    SIZE_UNITS = {'c': 1, 'k': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+    def cmd_find(self, args):
+        """Команда find - поиск по индексу с выводом совпадений по мере нахождения"""
+        usage = "Использование: find [dir] [-name <glob>] [-type f|d] [-size [+-]N[c|k|M|G]] [-newer YYYY-MM-DD[THH:MM[:SS]]]"
+        directory = None
+        if args and not args[0].startswith('-'):
+            directory, args = args[0], args[1:]
+
+        name_match = None
+        want_dir = None
+        size_test = None
+        newer = None
+        try:
+            for i in range(0, len(args), 2):
+                option, value = args[i], args[i + 1]
+                if option == '-name':
+                    name_match = re.compile(fnmatch.translate(value)).match
+                elif option == '-type' and value in ('f', 'd'):
+                    want_dir = value == 'd'
+                elif option == '-size':
+                    size_test = self._parse_size_test(value)
+                elif option == '-newer':
+                    newer = datetime.fromisoformat(value).timetuple()[:6]
+                else:
+                    raise ValueError(option)
+        except (IndexError, ValueError):
+            self.out.line(usage)
+            return False
+
+        if not self.vfs.archive:
+            self.out.line("VFS не загружена")
+            return False
+        base = self.vfs.resolve_path(directory)
+        if not self.vfs.index.is_dir(base):
+            self.out.line(f"Директория '{directory}' не найдена")
+            return False
+
+        table = self.vfs.entries
+        out = self.out
+        # Стартовая директория проверяется так же, как найденные элементы
+        candidates = chain([(base, True, None)], self.vfs.walk('/' + base))
+        for path, is_dir, entry_id in candidates:
+            if want_dir is not None and is_dir != want_dir:
+                continue
+            if name_match is not None and not name_match(path.rpartition('/')[2]):
+                continue
+            # Размер и время есть только у файлов
+            if size_test is not None and (is_dir or not size_test(table.file_size(entry_id))):
+                continue
+            if newer is not None and (is_dir or table.date_time(entry_id) <= newer):
+                continue
+            out.line('/' + path)
+            out.flush_if_stale()
+
+    def _parse_size_test(self, value):
+        """Условие -size: +N - больше, -N - меньше, N - ровно (байты или суффиксы c/k/M/G)"""
+        sign = value[:1] if value[:1] in '+-' else ''
+        number = value[len(sign):]
+        unit = 1
+        if number[-1:] in self.SIZE_UNITS:
+            unit = self.SIZE_UNITS[number[-1]]
+            number = number[:-1]
+        limit = int(number) * unit
+        if sign == '+':
+            return lambda size: size > limit
+        if sign == '-':
+            return lambda size: size < limit
+        return lambda size: size == limit
+
+    def cmd_du(self, args):
+        """Команда du - объем директорий по итогам поддеревьев из индекса (без распаковки)"""
+        options = set()
+        while args and args[0] in ('-h', '-s', '--compressed', '-hs', '-sh'):
+            options.update(('-h', '-s') if args[0] in ('-hs', '-sh') else (args[0],))
+            args = args[1:]
+        if len(args) > 1:
+            self.out.line("Использование: du [-h] [-s] [--compressed] [dir]")
+            return False
+        vfs = self.vfs
+        if not vfs.archive:
+            self.out.line("VFS не загружена")
+            return False
+
+        index = vfs.index
+        base = vfs.resolve_path(args[0] if args else None)
+        human = '-h' in options
+        compressed = '--compressed' in options
+
+        def report(path, size, packed):
+            # Со сжатием: распакованный объем, сжатый объем и доля сжатого от исходного
+            if compressed:
+                ratio = f"{packed / size:.0%}" if size else '-'
+                return (f"{self._format_size(size, human)}\t{self._format_size(packed, human)}\t"
+                        f"{ratio}\t/{path}")
+            return f"{self._format_size(size, human)}\t/{path}"
+
+        entry_id = index.get_file(base)
+        if entry_id is not None:
+            self.out.line(report(base, vfs.entries.file_size(entry_id), vfs.entries.compress_size(entry_id)))
             return
+        if not index.is_dir(base):
+            self.out.line(f"Директория '{args[0]}' не найдена")
+            return False
 
-        print(f"=== Содержимое файла '{filename}' ===")
-        for i, line in enumerate(content.split('\n'), 1):
-            print(f"{i:4d}: {line}")
+        if '-s' not in options:
+            # Поддиректории в обратном порядке обхода, как у du: потомки раньше родителя
+            stack = [(base, iter(index.subdirs(base)))]
+            while stack:
+                prefix, names = stack[-1]
+                name = next(names, None)
+                if name is not None:
+                    path = f"{prefix}/{name}" if prefix else name
+                    stack.append((path, iter(index.subdirs(path))))
+                    continue
+                stack.pop()
+                # Сама стартовая директория выводится после цикла (в том числе при -s)
+                if stack:
+                    _, size, packed = index.subtree_totals(prefix)
+                    self.out.line(report(prefix, size, packed))
+                    self.out.flush_if_stale()
+        _, size, packed = index.subtree_totals(base)
+        self.out.line(report(base, size, packed))
+
+    # Единицы для размеров в человекочитаемом виде
+    HUMAN_UNITS = ('K', 'M', 'G', 'T', 'P')
+
+    def _format_size(self, size, human):
+        """Размер в байтах или, при human, в K/M/G/T/P с основанием 1024"""
+        if not human or size < 1024:
+            return str(size)
+        for unit in self.HUMAN_UNITS:
+            size /= 1024
+            if size < 1024 or unit == self.HUMAN_UNITS[-1]:
+                return f"{size:.1f}{unit}" if size < 10 else f"{size:.0f}{unit}"
+
+    def cmd_grep(self, args):
+        """Команда grep - параллельный поиск строк по регулярному выражению"""
+        options = ''
+        while args and re.fullmatch(r'-[rin]+', args[0]):
+            options += args[0][1:]
+            args = args[1:]
+        if len(args) != 2:
+            self.out.line("Использование: grep [-r] [-i] [-n] <pattern> <path>")
+            return False
+        pattern, path = args
+        flags = re.IGNORECASE if 'i' in options else 0
+        try:
+            re.compile(pattern, flags)
+        except re.error as e:
+            self.out.line(f"Некорректное регулярное выражение: {e}")
+            return False
 
-    def cmd_vfs_info(self):
+        vfs = self.vfs
+        if not vfs.archive:
+            self.out.line("VFS не загружена")
+            return False
+        target = vfs.resolve_path(path)
+        entry_id = vfs.index.get_file(target)
+        if entry_id is not None:
+            paths = {entry_id: target}
+        elif not vfs.index.is_dir(target):
+            self.out.line(f"Файл '{path}' не найден")
+            return False
+        elif 'r' not in options:
+            self.out.line(f"'{path}' - директория (используйте grep -r)")
+            return False
+        else:
+            paths = {entry_id: member for member, is_dir, entry_id in vfs.walk('/' + target) if not is_dir}
+
+        if vfs.searcher is None:
+            vfs.searcher = ContentSearcher(vfs)
+        out = self.out
+        show_names = 'r' in options
+        for entry_id, matches, binary, error in vfs.searcher.search(paths, pattern, flags, vfs):
+            name = '/' + paths[entry_id]
+            if error:
+                out.line(f"grep: {name}: {error}")
+            elif binary:
+                out.line(f"Двоичный файл {name} совпадает")
+            elif matches:
+                prefix = f"{name}:" if show_names else ''
+                if 'n' in options:
+                    out.write(''.join([f"{prefix}{number}:{line}\n" for number, line in matches]))
+                else:
+                    out.write(''.join([f"{prefix}{line}\n" for _, line in matches]))
+            out.flush_if_stale()
+
+    def cmd_index_build(self, args=()):
+        """Команда index-build - построение полнотекстового индекса для grep и search"""
+        if not self.vfs.archive:
+            self.out.line("VFS не загружена")
+            return False
+        started = time.perf_counter()
+        index = self.vfs.build_text_index()
+        seconds = time.perf_counter() - started
+        path = self.vfs.vfs_path + TrigramIndex.SUFFIX
+        self.out.line(f"=== Полнотекстовый индекс VFS '{self.vfs.vfs_name}' ===")
+        self.out.line(f"Файлов:       {index.members - len(index.unindexed)} проиндексировано, "
+                      f"{len(index.unindexed)} пропущено (двоичные, не UTF-8, зашифрованные или больше "
+                      f"{TrigramIndex.MAX_MEMBER_BYTES >> 20} МБ)")
+        self.out.line(f"Триграмм:     {len(index.postings)}")
+        self.out.line(f"Время:        {seconds:.2f} с")
+        if os.path.exists(path):
+            self.out.line(f"Файл:         {path} ({os.path.getsize(path)} байт)")
+
+    def cmd_search(self, args):
+        """Команда search - файлы, содержащие все слова (без учета регистра), по полнотекстовому индексу"""
+        vfs = self.vfs
+        if not vfs.archive:
+            self.out.line("VFS не загружена")
+            return False
+        text_index = vfs.get_text_index()
+        if text_index is None:
+            self.out.line("Полнотекстовый индекс не построен (выполните index-build)")
+            return False
+
+        table = vfs.entries
+        candidates = None
+        for word in args:
+            ids = text_index.candidates(re.escape(word), re.IGNORECASE)
+            if ids is not None:
+                candidates = ids if candidates is None else candidates & ids
+        if candidates is None:
+            # Слова короче трех символов индекс не отбирает
+            candidates = [entry_id for entry_id in range(len(table)) if not table.name(entry_id).endswith('/')]
+
+        if vfs.searcher is None:
+            vfs.searcher = ContentSearcher(vfs)
+        words = [TrigramIndex.fold(word) for word in args]
+        pattern = '|'.join(re.escape(word) for word in args)
+        found = 0
+        for entry_id, matches, binary, error in vfs.searcher.search(candidates, pattern, re.IGNORECASE, vfs):
+            if error or binary or not matches:
+                continue
+            # Кандидат подтверждается, только если в нем встретились все слова
+            text = TrigramIndex.fold('\n'.join(line for _, line in matches))
+            if all(word in text for word in words):
+                found += 1
+                self.out.line(f"/{table.name(entry_id)}: строк с совпадениями {len(matches)}")
+                self.out.flush_if_stale()
+        self.out.line(f"Найдено файлов: {found} (проверено кандидатов: {len(candidates)})")
+
+    def cmd_vfs_info(self, args=()):
         """Команда vfs-info - информация о загруженной VFS"""
+        if args and args[0] == '--hash':
+            # Хеш считается в фоне, ход вычисления виден в следующих вызовах vfs-info
+            if self.vfs.start_hash():
+                self.out.line("Вычисление хеша запущено в фоне")
         info = self.vfs.get_vfs_info()
         if isinstance(info, str):
-            print(info)
+            self.out.line(info)
+            return False
         else:
-            print("=== Информация о VFS ===")
-            print(f"Имя:          {info['name']}")
-            print(f"Путь:         {info['path']}")
-            print(f"Хеш:          {info['hash']}")
-            print(f"Файлы:        {info['files_count']}")
-            print(f"Директории:   {info['dirs_count']}")
-            print(f"Всего:        {info['total_entries']}")
-            print(f"Размер:       {info['size']} байт")
-            print(f"Изменен:      {info['modified']}")
-
-    def cmd_history(self):
+            self.out.line("=== Информация о VFS ===")
+            self.out.line(f"Имя:          {info['name']}")
+            self.out.line(f"Путь:         {info['path']}")
+            self.out.line(f"Хеш:          {info['hash']}")
+            self.out.line(f"Файлы:        {info['files_count']}")
+            self.out.line(f"Директории:   {info['dirs_count']}")
+            self.out.line(f"Всего:        {info['total_entries']}")
+            self.out.line(f"Размер:       {info['size']} байт")
+            self.out.line(f"Изменен:      {info['modified']}")
+
+    def get_stats(self):
+        """Метрики сессии: задержки команд, объем распаковки и кэш"""
+        cache = self.vfs.content_cache
+        return {
+            'started': self.start_time.isoformat(timespec='seconds'),
+            'uptime_seconds': (datetime.now() - self.start_time).total_seconds(),
+            'commands': {name: histogram.summary() for name, histogram in sorted(self.latencies.items())},
+            'bytes_decompressed': self.vfs.bytes_decompressed,
+            'content_cache': cache.stats() if cache else None,
+        }
+
+    def dump_stats(self, path):
+        """Сохранение метрик в JSON (вызывается при выходе)"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.get_stats(), f, ensure_ascii=False, indent=2)
+
+    def cmd_stats(self, args=()):
+        """Команда stats - задержки команд и счетчики VFS"""
+        stats = self.get_stats()
+        if args and args[0] == '--json':
+            self.out.line(json.dumps(stats, ensure_ascii=False, indent=2))
+            return
+
+        self.out.line(f"=== Статистика сессии (работает {stats['uptime_seconds']:.0f} с) ===")
+        self.out.line(f"  {'команда':<12} {'вызовов':>8} {'всего мс':>10} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9}")
+        for name, summary in stats['commands'].items():
+            self.out.line(f"  {name:<12} {summary['count']:>8} {summary['total_ms']:>10.2f} "
+                          f"{summary['p50_ms']:>9.3f} {summary['p95_ms']:>9.3f} {summary['p99_ms']:>9.3f}")
+        self.out.line(f"Распаковано:  {stats['bytes_decompressed']} байт")
+        cache = stats['content_cache']
+        if cache:
+            self.out.line(f"Кэш:          {cache['entries']} файлов, {cache['bytes']} байт, "
+                          f"попаданий {cache['hit_rate']:.1%} ({cache['hits']}/{cache['hits'] + cache['misses']}), "
+                          f"вытеснений {cache['evictions']}")
+        else:
+            self.out.line("Кэш:          отключен")
+
+    def cmd_vfs_verify(self, args):
+        """Команда vfs-verify - параллельная проверка целостности архива по CRC-32"""
+        if not self.vfs.archive:
+            self.out.line("VFS не загружена")
+            return False
+
+        workers = None
+        if args:
+            if args[0] != '-j' or len(args) != 2 or not args[1].isdigit() or int(args[1]) <= 0:
+                self.out.line("Использование: vfs-verify [-j N]")
+                return False
+            workers = int(args[1])
+
+        result = ArchiveVerifier(self.vfs, workers).run()
+        seconds = result['seconds']
+        throughput = result['bytes'] / seconds / (1 << 20) if seconds else 0.0
+        self.out.line(f"=== Проверка VFS '{self.vfs.vfs_name}' ===")
+        self.out.line(f"Проверено:    {result['members']} файлов, {result['bytes']} байт")
+        self.out.line(f"Время:        {seconds:.2f} с, {throughput:.1f} МБ/с, потоков {result['workers']}")
+        if result['skipped']:
+            self.out.line(f"Пропущено:    {result['skipped']} (зашифрованы)")
+        if result['corrupt']:
+            self.out.line(f"Повреждено:   {len(result['corrupt'])}")
+            for name, reason in result['corrupt']:
+                self.out.line(f"  {name}: {reason}")
+            return False
+        else:
+            self.out.line("Повреждений не найдено")
+
+    def cmd_source(self, args):
+        """Команда source - выполнение скрипта (-q - без эха строк)"""
+        if self.remote:
+            # Скрипт читается с файловой системы сервера, а не клиента
+            self.out.line("Команда source недоступна в сессии сервера")
+            return False
+        quiet = args[0] == '-q'
+        if quiet:
+            args = args[1:]
+        if len(args) != 1:
+            self.out.line("Использование: source [-q] <file>")
+            return False
+        return self.execute_script(args[0], quiet)
+
+    def cmd_history(self, args=()):
         """Команда history - история команд"""
         if not self.history:
-            print("История команд пуста")
+            self.out.line("История команд пуста")
             return
 
-        print("=== История команд (последние 20) ===")
+        self.out.line("=== История команд (последние 20) ===")
         start_index = max(0, len(self.history) - 20)
         for i, cmd in enumerate(self.history[start_index:], start_index + 1):
-            print(f"{i:3d}: {cmd}")
+            self.out.line(f"{i:3d}: {cmd}")
 
-    def cmd_pwd(self):
+    def cmd_pwd(self, args=()):
         """Команда pwd - текущая директория"""
-        print(self.vfs.current_dir)
+        self.out.line(self.vfs.current_dir)
 
-    def cmd_help(self):
+    def cmd_help(self, args=()):
         """Команда help - справка по командам"""
-        print("=== Доступные команды ===")
-        commands = [
-            ("ls [dir]", "Список файлов и директорий"),
-            ("cd <dir>", "Смена текущей директории"),
-            ("pwd", "Текущая директория"),
-            ("cat <file>", "Вывод содержимого файла"),
-            ("tail <file> [n]", "Последние n строк файла (по умолчанию 10)"),
-            ("whoami", "Текущий пользователь системы"),
-            ("vfs-info", "Информация о загруженной VFS"),
-            ("history", "История выполненных команд"),
-            ("clear/clr", "Очистка экрана"),
-            ("help", "Эта справка"),
-            ("exit/quit", "Выход из программы")
-        ]
-        
-        for cmd, desc in commands:
-            print(f"  {cmd:<20} - {desc}")
-
-    def cmd_clear(self):
+        self.out.line("=== Доступные команды ===")
+        # Псевдонимы указывают на тот же объект команды - выводим каждую команду один раз
+        for entry in dict.fromkeys(self.commands.values()):
+            self.out.line(f"  {entry.synopsis():<20} - {entry.description}")
+
+    def cmd_exit(self, args=()):
+        """Команда exit - выход из эмулятора"""
+        self.out.line("Выход из эмулятора...")
+        self.out.flush()
+        sys.exit(0)
+
+    def cmd_clear(self, args=()):
         """Очистка экрана"""
+        if self.remote:
+            # Терминал клиента очищается управляющей последовательностью
+            self.out.write("\033[2J\033[H")
+            return
+        self.out.flush()
         os.system('cls' if os.name == 'nt' else 'clear')
 
+    def run_batch(self, source='-', delimiter=None):
+        """Пакетный режим: команды из файла или stdin ('-') без приглашения и эха.
+
+        Выводится только вывод команд (и delimiter после каждой, если задан).
+        Возвращает код завершения: 0 - все команды успешны, 1 - были ошибки, 2 - нет файла.
+        """
+        # Вывод сбрасывается только при заполнении буфера и в конце, имена без цветовых кодов
+        self.out.interactive = False
+        self.colors = False
+        failed = 0
+        try:
+            with (contextlib.nullcontext(sys.stdin) if source == '-'
+                  else open(source, 'r', encoding='utf-8')) as stream:
+                for _, command, args, entry in self.parse_script(stream):
+                    if args is None:
+                        continue
+                    if not self.run_parsed(command, args, entry):
+                        failed += 1
+                    if delimiter is not None:
+                        self.out.line(delimiter)
+        except OSError as e:
+            sys.stderr.write(f"Не удалось прочитать команды: {e}\n")
+            return 2
+        except SystemExit:
+            # Команда exit завершает пакет, код определяется ошибками до нее
+            pass
+        finally:
+            self.out.flush()
+        return 1 if failed else 0
+
     def run_interactive(self):
         """Интерактивный режим"""
         # Если VFS не загружена, предлагаем создать тестовую
@@ -431,36 +2736,222 @@ class ShellEmulator:
             if response.lower() in ['y', 'yes', 'д', 'да']:
                 test_path = "test.vfs"
                 if self.vfs.create_test_vfs(test_path):
-                    print("Тестовая VFS создана и загружена!")
+                    self.out.line("Тестовая VFS создана и загружена!")
                 else:
-                    print("Не удалось создать тестовую VFS")
-            print()
+                    self.out.line("Не удалось создать тестовую VFS")
+            self.out.line()
 
         # Выполнение стартового скрипта
         if self.script_path:
-            if self.execute_script(self.script_path):
-                print("Скрипт выполнен. Переход в интерактивный режим...")
+            if self.execute_script(self.script_path, self.quiet_script):
+                self.out.line("Скрипт выполнен. Переход в интерактивный режим...")
             else:
-                print("Ошибка выполнения скрипта. Переход в интерактивный режим...")
-            print()
+                self.out.line("Ошибка выполнения скрипта. Переход в интерактивный режим...")
+            self.out.line()
 
-        print("=" * 50)
-        print("Эмулятор командной оболочки - Вариант 12")
-        print("Для справки введите 'help'")
-        print("Для выхода введите 'exit' или 'quit'")
-        print("=" * 50)
-        print()
+        self.out.line("=" * 50)
+        self.out.line("Эмулятор командной оболочки - Вариант 12")
+        self.out.line("Для справки введите 'help'")
+        self.out.line("Для выхода введите 'exit' или 'quit'")
+        self.out.line("=" * 50)
+        self.out.line()
 
         while True:
             try:
+                self.out.flush()
                 command = input(self.get_prompt()).strip()
                 if command:
                     self.execute_command(command)
             except KeyboardInterrupt:
-                print("\nДля выхода введите 'exit' или 'quit'")
+                self.out.line("\nДля выхода введите 'exit' или 'quit'")
             except EOFError:
-                print("\nВыход...")
+                self.out.line("\nВыход...")
                 break
+        self.out.flush()
+
+
+register_command(Command('ls', ShellEmulator.cmd_ls, usage='ls [-laStr] [dir]',
+                         example='ls -lS /documents',
+                         description='Список файлов (-l подробно, -a скрытые, -S/-t по размеру/времени, -r обратно)'))
+register_command(Command('cd', ShellEmulator.cmd_cd, usage='cd <dir>',
+                         description='Смена текущей директории'))
+register_command(Command('pwd', ShellEmulator.cmd_pwd, description='Текущая директория'))
+register_command(Command('cat', ShellEmulator.cmd_cat, min_args=1, usage='cat <file>',
+                         example='cat readme.txt', description='Вывод содержимого файла'))
+register_command(Command('tail', ShellEmulator.cmd_tail, min_args=1, usage='tail <file> [n]',
+                         example='tail readme.txt 5',
+                         description='Последние n строк файла (по умолчанию 10)'))
+register_command(Command('find', ShellEmulator.cmd_find, usage='find [dir] [-name ...]',
+                         example='find / -name *.txt -type f -size +1k',
+                         description='Поиск файлов и директорий по индексу'))
+register_command(Command('du', ShellEmulator.cmd_du, usage='du [-h] [-s] [--compressed] [dir]',
+                         example='du -h --compressed /documents',
+                         description='Объем директорий (--compressed - со сжатым объемом)'))
+register_command(Command('grep', ShellEmulator.cmd_grep, min_args=2, usage='grep [-r] [-i] [-n] <pattern> <path>',
+                         example='grep -rn def /scripts',
+                         description='Поиск строк по регулярному выражению в нескольких процессах'))
+register_command(Command('search', ShellEmulator.cmd_search, min_args=1, usage='search <word>...',
+                         example='search helper return',
+                         description='Файлы со всеми словами (по полнотекстовому индексу)'))
+register_command(Command('index-build', ShellEmulator.cmd_index_build, max_args=0,
+                         description='Полнотекстовый индекс для grep и search (файл <vfs>.fts)'))
+register_command(Command('whoami', ShellEmulator.cmd_whoami, description='Текущий пользователь системы'))
+register_command(Command('vfs-info', ShellEmulator.cmd_vfs_info, usage='vfs-info [--hash]',
+                         description='Информация о VFS (--hash - посчитать хеш содержимого)'))
+register_command(Command('vfs-verify', ShellEmulator.cmd_vfs_verify, max_args=2, usage='vfs-verify [-j N]',
+                         description='Проверка CRC-32 всех файлов архива в N потоков'))
+register_command(Command('source', ShellEmulator.cmd_source, min_args=1, max_args=2,
+                         usage='source [-q] <file>', example='source -q audit.txt',
+                         description='Выполнение скрипта (-q - только вывод команд)'))
+register_command(Command('history', ShellEmulator.cmd_history, description='История выполненных команд'))
+register_command(Command('clear', ShellEmulator.cmd_clear, aliases=('clr',), description='Очистка экрана'))
+register_command(Command('profile', ShellEmulator.cmd_profile, min_args=1, usage='profile [-m] <cmd>',
+                         example='profile ls /documents',
+                         description='Профиль команды (-m - с местами выделения памяти)'))
+register_command(Command('stats', ShellEmulator.cmd_stats, usage='stats [--json]',
+                         description='Задержки команд, объем распаковки и кэш'))
+register_command(Command('help', ShellEmulator.cmd_help, description='Эта справка'))
+register_command(Command('exit', ShellEmulator.cmd_exit, aliases=('quit',), description='Выход из программы'))
+
+
+class _SessionStream:
+    """Бинарный поток вывода сессии сервера: запись из рабочего потока в сокет клиента.
+
+    Рабочий поток ждет, пока цикл событий отправит данные, - так медленный
+    клиент притормаживает свою команду, а не копит ее вывод в памяти. Клиент,
+    который не принимает вывод дольше WRITE_TIMEOUT секунд, отключается, чтобы
+    не занимать поток пула навсегда.
+    """
+
+    WRITE_TIMEOUT = 30
+
+    def __init__(self, writer, loop):
+        self.writer = writer
+        self.loop = loop
+        self.closed = False
+
+    def write(self, data):
+        if self.closed:
+            raise ConnectionError("сессия закрыта")
+        future = asyncio.run_coroutine_threadsafe(self._send(data), self.loop)
+        try:
+            future.result(self.WRITE_TIMEOUT)
+        except FutureTimeoutError:
+            future.cancel()
+            self.closed = True
+            # close() ждал бы отправки буфера, который клиент не читает
+            self.loop.call_soon_threadsafe(self.writer.transport.abort)
+            raise ConnectionError("клиент не принимает вывод") from None
+
+    async def _send(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def flush(self):
+        pass
+
+
+class ShellServer:
+    """Сервер оболочки на asyncio: одна загруженная VFS обслуживает много сессий.
+
+    У каждой сессии свои текущая директория, история и вывод; индекс, таблица
+    элементов, отображение архива и кэши общие. Команды выполняются в пуле
+    потоков, чтобы долгие чтения не останавливали цикл событий.
+    """
+
+    def __init__(self, vfs, workers=None):
+        self.vfs = vfs
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='vfs-session')
+        # Пул grep создается заранее, иначе сессии наперегонки заведут каждая свой;
+        # fork из многопоточного сервера небезопасен, процессы запускаются через forkserver
+        if vfs.archive:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            vfs.searcher = ContentSearcher(vfs, mp_context=context)
+            vfs.searcher.start()
+
+    async def serve(self, address):
+        """Прием подключений по адресу unix:/path или tcp:host:port до остановки цикла"""
+        kind, _, target = address.partition(':')
+        if kind == 'unix':
+            # Сокет, оставшийся от прошлого запуска, мешает привязке
+            if os.path.exists(target) and stat.S_ISSOCK(os.stat(target).st_mode):
+                os.unlink(target)
+            server = await asyncio.start_unix_server(self.handle, path=target)
+        else:
+            host, _, port = target.rpartition(':')
+            server = await asyncio.start_server(self.handle, host or None, int(port))
+        print(f"Сервер VFS '{self.vfs.vfs_name}' слушает {address}")
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        """Одна сессия: строки от клиента выполняются по очереди в пуле потоков"""
+        loop = asyncio.get_running_loop()
+        shell = ShellEmulator(vfs=self.vfs.session_view())
+        shell.out = ShellOutput(stream=_SessionStream(writer, loop))
+        shell.vfs.echo = shell.out.line
+        shell.remote = True
+        try:
+            await loop.run_in_executor(self.pool, self._greet, shell)
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode('utf-8', 'replace')
+                if not await loop.run_in_executor(self.pool, self._run, shell, command):
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    @staticmethod
+    def _greet(shell):
+        shell.out.line("Эмулятор командной оболочки - Вариант 12")
+        shell.out.line("Для справки введите 'help', для выхода - 'exit'")
+        shell.out.write(shell.get_prompt())
+        shell.out.flush()
+
+    @staticmethod
+    def _run(shell, command):
+        """Выполнение команды сессии в рабочем потоке; False - сессия закрыта командой exit"""
+        try:
+            shell.execute_command(command)
+        except SystemExit:
+            return False
+        shell.out.write(shell.get_prompt())
+        shell.out.flush()
+        return True
+
+
+def parse_serve_address(address):
+    """Проверка адреса сервера: unix:/path или tcp:host:port; текст ошибки или None"""
+    kind, _, target = address.partition(':')
+    if kind == 'unix' and target:
+        return None
+    if kind == 'tcp':
+        port = target.rpartition(':')[2]
+        if port.isdigit() and int(port) < 65536:
+            return None
+    return f"Некорректный адрес '{address}': ожидается unix:/path или tcp:host:port"
+
+
+def run_server(vfs, address, workers=None):
+    """Запуск сервера сессий до Ctrl+C"""
+    server = ShellServer(vfs, workers)
+    try:
+        asyncio.run(server.serve(address))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.pool.shutdown(wait=False)
+        if vfs.searcher is not None:
+            vfs.searcher.close()
 
 
 def create_example_script():
@@ -496,13 +2987,160 @@ cd /
     return script_path
 
 
+# Профили нагрузки генератора тестовых VFS
+WORKLOADS = ('wide', 'deep', 'tiny', 'huge', 'binary', 'mixed', 'non-utf8')
+
+_WORDS = ('vfs', 'archive', 'строка', 'данные', 'log', 'error', 'info', 'request',
+          'ответ', 'файл', 'user', 'config', 'value', 'тест', 'debug', 'offset')
+# Символы, которые есть в cp437: имена с ними записываются без флага UTF-8
+_LEGACY_CHARS = 'äöüéèçñÅÉæß'
+
+
+class _LegacyNameInfo(zipfile.ZipInfo):
+    """ZipInfo, имя которого кодируется в cp437 без флага UTF-8 (как в старых архиваторах)"""
+    __slots__ = ()
+
+    def _encodeFilenameFlags(self):
+        return self.filename.encode('cp437'), self.flag_bits
+
+
+def _text_block(rng, size):
+    """Блок текста из случайных слов размером не меньше size байт"""
+    lines = []
+    total = 0
+    while total < size:
+        line = ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(3, 12)))
+        lines.append(line)
+        total += len(line.encode('utf-8')) + 1
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def _huge_chunks(rng, megabytes):
+    """Поток мегабайтных блоков: общий текст плюс номер блока, без хранения файла в памяти"""
+    block = _text_block(rng, 1 << 20)
+    for i in range(megabytes):
+        yield f"--- block {i} ---\n".encode('ascii')
+        yield block
+
+
+def _random_date_time(rng):
+    return (rng.randint(2000, 2024), rng.randint(1, 12), rng.randint(1, 28),
+            rng.randint(0, 23), rng.randint(0, 59), rng.randrange(0, 60, 2))
+
+
+def _workload_members(workload, entries, rng, huge_mb):
+    """Генератор описаний элементов: (имя, блоки данных, метод сжатия, cp437-имя)"""
+    deflated, stored = zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED
+    if workload == 'wide':
+        # Несколько директорий с огромным числом файлов в каждой
+        for i in range(entries):
+            yield f"wide{i % 4}/file_{i:08d}.txt", [_text_block(rng, rng.randint(64, 2048))], deflated, False
+    elif workload == 'deep':
+        # Случайное блуждание по дереву глубиной до 32 уровней
+        path = []
+        for i in range(entries):
+            if len(path) < 32 and rng.random() < 0.6:
+                path.append(f"d{rng.randint(0, 3)}")
+            elif path and rng.random() < 0.5:
+                path.pop()
+            yield '/'.join(path + [f"f{i:08d}.txt"]), [_text_block(rng, rng.randint(32, 512))], deflated, False
+    elif workload == 'tiny':
+        # Очень много очень маленьких файлов, по сотне в директории
+        for i in range(entries):
+            data = _text_block(rng, 1)[:rng.randint(0, 64)]
+            yield f"tiny{i // 100:06d}/t{i:08d}", [data], stored, False
+    elif workload == 'huge':
+        # Немного файлов по huge_mb мегабайт, записываются потоково
+        for i in range(entries):
+            method = stored if i % 2 else deflated
+            yield f"huge/log_{i:04d}.log", _huge_chunks(rng, huge_mb), method, False
+    elif workload == 'binary':
+        # Несжимаемые случайные данные
+        for i in range(entries):
+            yield f"blobs/{i % 16:02d}/blob_{i:08d}.bin", [rng.randbytes(rng.randint(1024, 256 * 1024))], stored, False
+    elif workload == 'mixed':
+        # Текст и бинарные данные вперемешку, метод сжатия выбирается случайно
+        for i in range(entries):
+            if rng.random() < 0.5:
+                data, suffix = _text_block(rng, rng.randint(64, 64 * 1024)), 'txt'
+            else:
+                data, suffix = rng.randbytes(rng.randint(64, 64 * 1024)), 'bin'
+            yield f"mixed/{i % 32:02d}/item_{i:08d}.{suffix}", [data], rng.choice((stored, deflated)), False
+    elif workload == 'non-utf8':
+        # Имена в cp437 без флага UTF-8 и имена в UTF-8 с кириллицей
+        for i in range(entries):
+            word = ''.join(rng.choice(_LEGACY_CHARS) for _ in range(rng.randint(2, 6)))
+            if i % 2:
+                yield f"légacy/{word}_{i:06d}.txt", [_text_block(rng, 128)], deflated, True
+            else:
+                yield f"юникод/файл_{word}_{i:06d}.txt", [_text_block(rng, 128)], deflated, False
+    else:
+        raise ValueError(f"Неизвестный профиль: {workload}")
+
+
+def generate_vfs(vfs_path, workload, entries=1000, seed=0, huge_mb=64):
+    """Генерация синтетической VFS заданного профиля; данные пишутся в архив потоково"""
+    rng = random.Random(seed)
+    count = 0
+    total = 0
+    with zipfile.ZipFile(vfs_path, 'w', allowZip64=True) as zf:
+        for name, chunks, method, legacy in _workload_members(workload, entries, rng, huge_mb):
+            info_class = _LegacyNameInfo if legacy else zipfile.ZipInfo
+            info = info_class(name, _random_date_time(rng))
+            info.compress_type = method
+            info.external_attr = 0o644 << 16
+            # force_zip64: размер заранее неизвестен, файл может превысить 4 ГБ
+            with zf.open(info, 'w', force_zip64=workload == 'huge') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    total += len(chunk)
+            count += 1
+    print(f"Создана VFS '{vfs_path}': профиль {workload}, файлов {count}, данных {total} байт (seed={seed})")
+    return count
+
+
 def main():
     """Основная функция"""
     parser = argparse.ArgumentParser(description='Эмулятор командной оболочки - Вариант 12')
     parser.add_argument('--vfs', help='Путь к файлу VFS (ZIP-архив)')
     parser.add_argument('--script', help='Путь к стартовому скрипту')
+    parser.add_argument('--quiet-script', action='store_true',
+                       help='Выполнять стартовый скрипт без эха строк (только вывод команд)')
     parser.add_argument('--create-example', action='store_true', 
                        help='Создать пример VFS и скрипта')
+    parser.add_argument('--generate', metavar='PATH',
+                       help='Сгенерировать синтетическую VFS для нагрузочного тестирования')
+    parser.add_argument('--workload', choices=WORKLOADS, default='mixed',
+                       help='Профиль генерируемой VFS')
+    parser.add_argument('--entries', type=int, default=1000,
+                       help='Количество файлов в генерируемой VFS')
+    parser.add_argument('--seed', type=int, default=0,
+                       help='Начальное значение генератора (одинаковый seed - одинаковый архив)')
+    parser.add_argument('--huge-mb', type=int, default=64,
+                       help='Размер файлов в профиле huge, МБ')
+    parser.add_argument('--compact-index', action='store_true',
+                       help='Компактный индекс директорий (для архивов с миллионами файлов, включает --lean)')
+    parser.add_argument('--lean', action='store_true',
+                       help='Экономное чтение каталога архива без создания ZipInfo на каждый файл')
+    parser.add_argument('--index-cache', action='store_true',
+                       help='Сохранять индекс в файл <vfs>.idx и использовать его при следующих запусках')
+    parser.add_argument('--cache-mb', type=int, default=64,
+                       help='Объем кэша распакованных файлов в МБ (0 - отключить)')
+    parser.add_argument('--profile', action='store_true',
+                       help='Профилировать каждую команду (cProfile), отчеты выводятся в stderr')
+    parser.add_argument('--profile-memory', action='store_true',
+                       help='Вместе с --profile отслеживать выделения памяти (tracemalloc)')
+    parser.add_argument('--stats-json', metavar='PATH',
+                       help='Сохранить статистику команд в JSON при выходе')
+    parser.add_argument('--batch', nargs='?', const='-', metavar='FILE',
+                       help='Пакетный режим: команды из FILE или stdin, только вывод команд, '
+                            'код выхода 1 при ошибках')
+    parser.add_argument('--delimiter', metavar='TEXT',
+                       help='В пакетном режиме - строка-разделитель после вывода каждой команды')
+    parser.add_argument('--serve', metavar='ADDRESS',
+                       help='Режим сервера: unix:/path или tcp:host:port, одна VFS на все сессии')
+    parser.add_argument('--serve-workers', type=int,
+                       help='Число потоков для команд сессий сервера')
 
     args = parser.parse_args()
 
@@ -517,10 +3155,34 @@ def main():
         print(f"python import_o5.py --vfs {vfs_path} --script {script_path}")
         return
 
-    # Создание эмулятора
-    emulator = ShellEmulator(args.vfs, args.script)
+    if args.generate:
+        generate_vfs(args.generate, args.workload, args.entries, args.seed, args.huge_mb)
+        return
+
+    # Создание эмулятора; в пакетном режиме сообщения загрузки VFS уходят в stderr
+    with contextlib.redirect_stdout(sys.stderr) if args.batch else contextlib.nullcontext():
+        emulator = ShellEmulator(args.vfs, args.script, profile=args.profile,
+                                 profile_memory=args.profile_memory, quiet_script=args.quiet_script,
+                                 compact_index=args.compact_index,
+                                 lean=args.lean, index_cache=args.index_cache,
+                                 cache_bytes=args.cache_mb << 20)
+
+    # Статистика сохраняется при любом завершении, в том числе по команде exit
+    if args.stats_json:
+        atexit.register(emulator.dump_stats, args.stats_json)
 
     # Запуск
+    if args.serve:
+        error = parse_serve_address(args.serve)
+        if error:
+            print(error, file=sys.stderr)
+            sys.exit(2)
+        run_server(emulator.vfs, args.serve, args.serve_workers)
+        return
+    if args.batch:
+        # Стартовый скрипт в пакетном режиме выполняется так же, без эха
+        code = emulator.run_batch(args.script, args.delimiter) if args.script else 0
+        sys.exit(max(code, emulator.run_batch(args.batch, args.delimiter)))
     emulator.run_interactive()
 
 
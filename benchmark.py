@@ -0,0 +1,206 @@
+"""Бенчмарк основных операций VFS на архивах разного размера и формы.
+
+Каждый сценарий (размер архива, форма дерева, размер файлов) запускается
+в отдельном процессе, чтобы пиковый RSS относился только к нему.
+Результат - JSON со скоростью (ops/sec), задержками p50/p99 и пиковым RSS.
+
+Пример:
+    python benchmark.py --sizes 1000,10000,100000 --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import zipfile
+import argparse
+import tempfile
+import subprocess
+import contextlib
+
+from Main import ShellEmulator, ShellOutput
+
+SHAPES = ('shallow', 'deep')
+MEMBERS = ('small', 'huge')
+# Глубина дерева в форме deep и ширина директорий в форме shallow
+DEEP_LEVELS = 8
+SHALLOW_DIRS = 16
+# Число больших файлов в профиле huge
+HUGE_FILES = 2
+
+
+def member_path(i, shape):
+    """Путь i-го файла в архиве заданной формы"""
+    if shape == 'deep':
+        parts = [f"level{depth}_{(i >> depth) % 4}" for depth in range(DEEP_LEVELS)]
+        return '/'.join(parts) + f"/file_{i:07d}.txt"
+    return f"dir{i % SHALLOW_DIRS:02d}/file_{i:07d}.txt"
+
+
+def build_archive(path, entries, shape, members, huge_mb):
+    """Создание тестового архива (пропускается, если он уже есть)"""
+    if os.path.exists(path):
+        return
+    line = b"benchmark line of text for tail and cat\n"
+    small = line * 4
+    huge_chunk = line * ((1 << 20) // len(line))
+    tmp_path = path + '.tmp'
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        for i in range(entries):
+            name = member_path(i, shape)
+            if members == 'huge' and i < HUGE_FILES:
+                # Большие файлы пишутся потоково, по мегабайту: первый несжатым, второй сжатым
+                info = zipfile.ZipInfo(name, (2024, 1, 1, 0, 0, 0))
+                info.compress_type = zipfile.ZIP_STORED if i == 0 else zipfile.ZIP_DEFLATED
+                with zf.open(info, 'w', force_zip64=True) as f:
+                    for _ in range(huge_mb):
+                        f.write(huge_chunk)
+            else:
+                zf.writestr(name, small)
+    os.replace(tmp_path, path)
+
+
+def posix_dirname(path):
+    return path.rsplit('/', 1)[0] or '/'
+
+
+def peak_rss_bytes():
+    """Пиковый RSS процесса (None, если модуль resource недоступен)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux возвращает килобайты, macOS - байты
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def measure(operation, iterations, min_seconds):
+    """Замер операции: не меньше iterations повторов и не меньше min_seconds секунд"""
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < iterations or time.perf_counter() - started < min_seconds:
+        begin = time.perf_counter_ns()
+        operation()
+        samples.append(time.perf_counter_ns() - begin)
+    samples.sort()
+    total = sum(samples)
+    return {
+        'iterations': len(samples),
+        'ops_per_sec': len(samples) / (total / 1e9) if total else None,
+        'p50_us': samples[len(samples) // 2] / 1000,
+        'p99_us': samples[min(len(samples) - 1, len(samples) * 99 // 100)] / 1000,
+    }
+
+
+def run_scenario(path, entries, shape, members, options, iterations, min_seconds):
+    """Замеры всех операций на одном архиве (выполняется в дочернем процессе)"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        shell = ShellEmulator(path, **options)
+        load_seconds = time.perf_counter() - started
+
+    vfs = shell.vfs
+    vfs.echo = lambda *args: None
+    shell.out = ShellOutput(stream=open(os.devnull, 'wb'), interactive=False)
+
+    target_file = '/' + member_path(0 if members == 'huge' else entries // 2, shape)
+    target_dir = posix_dirname(target_file)
+
+    def change_directory():
+        vfs.change_directory(target_dir)
+        vfs.change_directory('/')
+
+    def tail():
+        shell.cmd_tail([target_file, '10'])
+        shell.out.flush()
+
+    results = {
+        'list_files': measure(lambda: vfs.list_files(target_dir), iterations, min_seconds),
+        'change_directory': measure(change_directory, iterations, min_seconds),
+        'read_file': measure(lambda: vfs.read_file(target_file), max(1, iterations // 10), min_seconds),
+        'cmd_tail': measure(tail, max(1, iterations // 10), min_seconds),
+        'get_vfs_info': measure(vfs.get_vfs_info, iterations, min_seconds),
+    }
+    report = {
+        'entries': entries,
+        'shape': shape,
+        'members': members,
+        'options': options,
+        'archive_bytes': os.path.getsize(path),
+        'load_seconds': load_seconds,
+        'operations': results,
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+    # Для компактного индекса - проверка документированной цели по памяти
+    if hasattr(vfs.index, 'bytes_per_entry'):
+        report['index_bytes_per_entry'] = vfs.index.bytes_per_entry()
+        report['index_target_met'] = report['index_bytes_per_entry'] <= vfs.index.TARGET_BYTES_PER_ENTRY
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк операций VFS')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='Размеры архивов через запятую (например 1000,10000,100000,1000000)')
+    parser.add_argument('--shapes', default=','.join(SHAPES), help='Формы дерева: shallow,deep')
+    parser.add_argument('--members', default=','.join(MEMBERS), help='Размеры файлов: small,huge')
+    parser.add_argument('--huge-mb', type=int, default=64, help='Размер больших файлов в МБ')
+    parser.add_argument('--iterations', type=int, default=200, help='Минимум повторов на операцию')
+    parser.add_argument('--min-seconds', type=float, default=0.5, help='Минимальное время замера операции')
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'vfs-bench'),
+                        help='Каталог для сгенерированных архивов (переиспользуются)')
+    parser.add_argument('--lean', action='store_true', help='Экономное чтение каталога архива')
+    parser.add_argument('--compact-index', action='store_true', help='Компактный индекс директорий')
+    # По умолчанию кэш отключен, иначе повторные чтения сжатых файлов меряют попадания в кэш
+    parser.add_argument('--cache-mb', type=int, default=0,
+                        help='Кэш распакованного содержимого в МБ (0 - отключен)')
+    parser.add_argument('--output', help='Файл для JSON-результата (по умолчанию stdout)')
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    options = {'lean': args.lean, 'compact_index': args.compact_index, 'cache_bytes': args.cache_mb << 20}
+
+    # Дочерний процесс: один сценарий, результат - JSON в stdout
+    if args.scenario:
+        path, entries, shape, members = json.loads(args.scenario)
+        result = run_scenario(path, entries, shape, members, options, args.iterations, args.min_seconds)
+        json.dump(result, sys.stdout)
+        return
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = []
+    for entries in (int(size) for size in args.sizes.split(',')):
+        for shape in args.shapes.split(','):
+            for members in args.members.split(','):
+                name = f"bench_{entries}_{shape}_{members}_{args.huge_mb if members == 'huge' else 0}.zip"
+                path = os.path.join(args.workdir, name)
+                print(f"[bench] {name}", file=sys.stderr)
+                build_archive(path, entries, shape, members, args.huge_mb)
+
+                command = [sys.executable, os.path.abspath(__file__),
+                           '--scenario', json.dumps([path, entries, shape, members]),
+                           '--iterations', str(args.iterations),
+                           '--min-seconds', str(args.min_seconds)]
+                if args.lean:
+                    command.append('--lean')
+                if args.compact_index:
+                    command.append('--compact-index')
+                command += ['--cache-mb', str(args.cache_mb)]
+                child = subprocess.run(command, capture_output=True, text=True, check=True)
+                results.append(json.loads(child.stdout))
+
+    report = {
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'scenarios': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""Проверка целевого расхода памяти компактного индекса"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Main import CompactIndex, VirtualFileSystem, generate_vfs
+
+
+class CompactIndexMemoryTest(unittest.TestCase):
+    """Расход памяти индекса на элемент архива не превышает заявленной цели"""
+
+    def test_bytes_per_entry_target(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'wide.vfs')
+            with contextlib.redirect_stdout(io.StringIO()):
+                generate_vfs(path, 'wide', entries=5000)
+                vfs = VirtualFileSystem(path, compact_index=True)
+            self.assertIsInstance(vfs.index, CompactIndex)
+            # Без экономного чтения память занимали бы ZipInfo каждого файла
+            self.assertTrue(vfs.lean)
+            self.assertLessEqual(vfs.index.bytes_per_entry(), CompactIndex.TARGET_BYTES_PER_ENTRY)
+
+
+if __name__ == '__main__':
+    unittest.main()
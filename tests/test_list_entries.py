@@ -0,0 +1,48 @@
+"""Проверка листинга директорий VFS"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Main import ShellEmulator, VirtualFileSystem
+
+
+class ListEntriesTest(unittest.TestCase):
+    """Элемент с нулевым DOS-временем не ломает ls"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'zt.zip')
+        with zipfile.ZipFile(self.path, 'w') as zf:
+            zf.writestr(zipfile.ZipInfo('zero.txt', (1980, 0, 0, 0, 0, 0)), 'нулевая дата')
+            zf.writestr(zipfile.ZipInfo('dated.txt', (2024, 5, 17, 12, 30, 0)), 'обычная дата')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_zero_date(self):
+        for lean in (False, True):
+            with contextlib.redirect_stdout(io.StringIO()):
+                vfs = VirtualFileSystem(self.path, lean=lean)
+            entries = {entry.name: entry for entry in vfs.list_entries()}
+            self.assertIsNone(entries['zero.txt'].mtime)
+            self.assertEqual(entries['dated.txt'].mtime.year, 2024)
+
+    def test_ls_long(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            shell = ShellEmulator(self.path)
+            self.assertTrue(shell.dispatch(['ls', '-lt']))
+            shell.out.flush()
+        self.assertIn('zero.txt', output.getvalue())
+        self.assertIn('2024-05-17 12:30', output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""Проверка полнотекстового индекса: отбор кандидатов не теряет совпадений grep"""
+
+import contextlib
+import io
+import os
+import re
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Main import ShellEmulator
+
+
+MEMBERS = {
+    'greek.txt': 'ΟΔΟΣΑ\nοδός\n',
+    'long_s.txt': 'Meſſage\n',
+    'kelvin.txt': '300 KKK\n',
+    'turkish.txt': 'İSTANBUL ııı\n',
+    'plain.txt': 'Hello, World\nstrasse STRASSE\n',
+}
+
+PATTERNS = ['ΟΔΟΣ', 'οδοσ', 'MESSAGE', 'kkk', 'istanbul', 'III', 'hello', 'world', 'STRASSE']
+
+
+class TextIndexGrepTest(unittest.TestCase):
+    """grep -i с индексом и без него находит одно и то же"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'fts.zip')
+        with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name, text in MEMBERS.items():
+                zf.writestr(name, text)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.shell = ShellEmulator(self.path)
+
+    def tearDown(self):
+        if self.shell.vfs.searcher is not None:
+            self.shell.vfs.searcher.close()
+        self.tmp.cleanup()
+
+    def grep(self, pattern):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.shell.dispatch(['grep', '-ri', pattern, '/'])
+            self.shell.out.flush()
+        return output.getvalue()
+
+    def test_index_keeps_matches(self):
+        expected = {pattern: self.grep(pattern) for pattern in PATTERNS}
+        for pattern in PATTERNS:
+            found = any(re.search(pattern, text, re.IGNORECASE) for text in MEMBERS.values())
+            self.assertEqual(found, '/' in expected[pattern], pattern)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.shell.dispatch(['index-build'])
+        self.assertIsNotNone(self.shell.vfs.get_text_index())
+        for pattern in PATTERNS:
+            self.assertEqual(self.grep(pattern), expected[pattern], pattern)
+
+
+if __name__ == '__main__':
+    unittest.main()